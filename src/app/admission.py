@@ -0,0 +1,251 @@
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+from collections import OrderedDict, deque
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+QueueCallback = Callable[[int], Awaitable[None]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token), good enough for rate limiting."""
+    return max(1, len(text) // 4)
+
+
+class AdmissionTimeout(Exception):
+    """Raised when a request could not be admitted within the maximum wait."""
+
+
+class TokenBucket:
+    """A continuously refilled token bucket."""
+
+    def __init__(self, per_minute: float):
+        """
+        Initialize a new token bucket.
+
+        Args:
+            per_minute: Budget per minute. It is also the burst capacity. 0 means unlimited.
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (0 if it can be taken now)."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.unlimited:
+            return
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class _Waiter:
+    def __init__(self, session_id: str, tokens: int, on_queue: Optional[QueueCallback]):
+        self.session_id = session_id
+        self.tokens = tokens
+        self.on_queue = on_queue
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.position = 0
+
+
+class AdmissionController:
+    """
+    Admission control in front of every Groq call.
+
+    Requests are admitted while the requests-per-minute and tokens-per-minute
+    buckets allow it. Excess requests wait in per-session queues served in
+    round-robin order, so one chatty session cannot starve the others, and
+    are told their queue position while they wait.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, max_wait: float = 30.0, max_queue: int = 1000):
+        """
+        Initialize a new admission controller.
+
+        Args:
+            requests_per_minute: Request budget per minute. 0 means unlimited.
+            tokens_per_minute: Token budget per minute. 0 means unlimited.
+            max_wait: Maximum time in seconds a request may wait in the queue.
+            max_queue: Maximum number of queued requests; further requests are rejected.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        # session_id -> FIFO of waiters; dict order is the round-robin order
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._notifications: Set[asyncio.Task] = set()
+        self.admitted = 0
+        self.queued_total = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return not (self.requests.unlimited and self.tokens.unlimited)
+
+    def _time_until(self, tokens: int) -> float:
+        return max(self.requests.time_until(1), self.tokens.time_until(tokens))
+
+    def _take(self, tokens: int) -> None:
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.admitted += 1
+
+    async def acquire(self, session_id: Optional[str], tokens: int, on_queue: Optional[QueueCallback] = None) -> None:
+        """
+        Wait until a request may be sent upstream.
+
+        Args:
+            session_id: The session making the request, used for fair ordering.
+            tokens: Estimated tokens of the request (prompt and expected completion).
+            on_queue: Called with the 1-based queue position whenever it changes, and with 0 once admitted.
+
+        Raises:
+            AdmissionTimeout: If the queue is full or the request waited longer than max_wait.
+        """
+        if not self.enabled:
+            return
+        if not self._queued and self._time_until(tokens) == 0:
+            self._take(tokens)
+            return
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionTimeout("Too many requests are waiting for the upstream")
+
+        waiter = _Waiter(session_id or "anonymous", tokens, on_queue)
+        self._queues.setdefault(waiter.session_id, deque()).append(waiter)
+        self._queued += 1
+        self.queued_total += 1
+        self._notify_positions()
+        self._ensure_dispatcher()
+
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.max_wait)
+        finally:
+            if not waiter.future.done():
+                self._remove(waiter)
+                waiter.future.cancel()
+        if waiter.future.cancelled():
+            self.timeouts += 1
+            raise AdmissionTimeout(f"Request was not admitted within {self.max_wait:.0f}s")
+
+    def try_acquire(self, tokens: int) -> bool:
+        """
+        Admit a request only if the budget allows it right now and nobody is waiting.
+
+        Used for optional requests (such as hedges) that must never queue.
+        """
+        if not self.enabled:
+            return True
+        if self._queued or self._time_until(tokens) > 0:
+            return False
+        self._take(tokens)
+        return True
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.session_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.session_id]
+        self._notify_positions()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _ensure_dispatcher(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self) -> None:
+        while self._queued:
+            session_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            wait = self._time_until(waiter.tokens)
+            if wait > 0:
+                # Sleep until the budget refills, or until the queue changes
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            queue.popleft()
+            self._queued -= 1
+            # Round-robin: the session goes to the back of the line
+            del self._queues[session_id]
+            if queue:
+                self._queues[session_id] = queue
+            self._take(waiter.tokens)
+            waiter.future.set_result(True)
+            self._send_position(waiter, 0)
+            self._notify_positions()
+
+    def _round_robin_order(self) -> List[_Waiter]:
+        order = []
+        queues = [list(queue) for queue in self._queues.values()]
+        depth = max((len(queue) for queue in queues), default=0)
+        for round_index in range(depth):
+            for queue in queues:
+                if round_index < len(queue):
+                    order.append(queue[round_index])
+        return order
+
+    def _notify_positions(self) -> None:
+        for position, waiter in enumerate(self._round_robin_order(), start=1):
+            if waiter.position != position:
+                self._send_position(waiter, position)
+
+    def _send_position(self, waiter: _Waiter, position: int) -> None:
+        waiter.position = position
+        if waiter.on_queue is None:
+            return
+        # Never let a slow websocket hold up the dispatcher
+        task = asyncio.create_task(self._safe_callback(waiter.on_queue, position))
+        self._notifications.add(task)
+        task.add_done_callback(self._notifications.discard)
+
+    async def _safe_callback(self, callback: QueueCallback, position: int) -> None:
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.warning(f"Could not send queue position: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queued,
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,124 @@
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import re
+import time
+import unicodedata
+
+NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a user question so trivial variations share a cache entry.
+    Case, accents, punctuation and extra whitespace are ignored.
+    """
+    text = unicodedata.normalize("NFKD", query.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return NON_WORD.sub(" ", text).strip()
+
+
+def make_cache_key(query: str, mode: str, template_version: str, model: str, context: str = "") -> str:
+    """
+    Build the cache key of a question.
+
+    Args:
+        query: The raw user question.
+        mode: The endpoint mode (chat, course or evaluation).
+        template_version: Version of the prompt templates, so editing a prompt invalidates old answers.
+        model: The LLM model name.
+        context: Other prompt content the answer depends on, such as the retrieved passages,
+            so an answer is not replayed once they change.
+
+    Returns:
+        A hex digest identifying the question.
+    """
+    context_digest = hashlib.sha256(context.encode("utf-8")).hexdigest() if context else ""
+    raw = "\x1f".join([mode, template_version, model, context_digest, normalize_query(query)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """A bounded LRU cache of complete answers with a time-to-live."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600.0):
+        """
+        Initialize a new response cache.
+
+        Args:
+            max_entries: Maximum number of cached answers. 0 disables the cache.
+            ttl: Time-to-live of an answer in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expiry, chunks)
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[str, ...]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> Optional[Tuple[str, ...]]:
+        """
+        Look up an answer.
+
+        Args:
+            key: The cache key from make_cache_key.
+
+        Returns:
+            The answer's chunks, in the order they were streamed, or None on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expiry, chunks = entry
+        if expiry < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return chunks
+
+    def put(self, key: str, chunks: Tuple[str, ...]) -> None:
+        """
+        Store a complete answer.
+
+        Args:
+            key: The cache key from make_cache_key.
+            chunks: The answer's chunks, in the order they were streamed.
+        """
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, tuple(chunks))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def record_bypass(self) -> None:
+        """Count a request that was not eligible for caching."""
+        self.bypasses += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,150 @@
+from typing import Any, Deque, Dict, Tuple
+from collections import deque
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one upstream endpoint (chat, speech-to-text, text-to-speech).
+
+    The circuit opens when, over the last `window` calls, the error rate or
+    the rate of slow calls reaches its threshold. While open, calls fail
+    immediately with CircuitOpenError. After `open_duration` the circuit is
+    half-open: a few probe calls go through, and their outcome closes or
+    re-opens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        error_rate_threshold: float = 0.5,
+        slow_call_threshold: float = 10.0,
+        slow_rate_threshold: float = 0.8,
+        open_duration: float = 30.0,
+        half_open_probes: int = 1
+    ):
+        """
+        Initialize a new circuit breaker.
+
+        Args:
+            name: The endpoint name, for logs and stats.
+            window: Number of recent calls considered.
+            min_calls: Minimum calls in the window before the circuit may open.
+            error_rate_threshold: Error rate (0-1) that opens the circuit.
+            slow_call_threshold: Latency in seconds above which a successful call counts as slow.
+            slow_rate_threshold: Slow call rate (0-1) that opens the circuit.
+            open_duration: Seconds the circuit stays open before probing.
+            half_open_probes: Concurrent probe calls allowed while half-open.
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        # (failed, slow) for the most recent calls
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+            logger.info(f"Circuit {self.name} half-open, probing upstream")
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def before_call(self) -> float:
+        """
+        Check that a call may proceed.
+
+        Returns:
+            The start time, to pass to record_success.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with every probe slot taken.
+        """
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self._probes_in_flight >= self.half_open_probes):
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit {self.name} is open")
+        if state == HALF_OPEN:
+            self._probes_in_flight += 1
+        return time.monotonic()
+
+    def record_success(self, started: float) -> None:
+        """Record a successful call started at `started` (from before_call)."""
+        slow = time.monotonic() - started >= self.slow_call_threshold
+        if self._state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if slow:
+                self._open()
+            else:
+                self._close()
+            return
+        self._outcomes.append((False, slow))
+        self._evaluate()
+
+    def record_failure(self) -> None:
+        """Record a failed call."""
+        if self._state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self._open()
+            return
+        self._outcomes.append((True, False))
+        self._evaluate()
+
+    def release(self) -> None:
+        """Forget a call that was abandoned before its outcome was known."""
+        if self._state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _evaluate(self) -> None:
+        if self._state != CLOSED or len(self._outcomes) < self.min_calls:
+            return
+        calls = len(self._outcomes)
+        error_rate = sum(1 for failed, _ in self._outcomes if failed) / calls
+        slow_rate = sum(1 for _, slow in self._outcomes if slow) / calls
+        if error_rate >= self.error_rate_threshold or slow_rate >= self.slow_rate_threshold:
+            logger.error(f"Circuit {self.name} opening: error rate {error_rate:.0%}, slow rate {slow_rate:.0%}")
+            self._open()
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+
+    def _close(self) -> None:
+        logger.info(f"Circuit {self.name} closed, upstream recovered")
+        self._state = CLOSED
+        self._outcomes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "window_calls": len(self._outcomes)
+        }
@@ -0,0 +1,183 @@
+from typing import Any, Awaitable, Callable, Dict, List
+import asyncio
+import itertools
+import json
+import logging
+import weakref
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+# Frames with a lower priority value are written first
+CONTROL_PRIORITY = 0
+DATA_PRIORITY = 1
+
+# One lock per session, shared by every socket attached to it, so answers
+# are generated and recorded in memory in the order the questions arrived
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def get_session_lock(session_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
+
+
+class Connection:
+    """
+    Full-duplex handling of one websocket.
+
+    A reader loop keeps receiving frames while answers stream, so pings,
+    cancels and the next question are handled immediately. Every outgoing
+    frame goes through a single writer task (websockets do not support
+    concurrent sends), with control frames jumping ahead of answer text.
+    Answers run as tasks serialized by the per-session ordering lock.
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: str, cancel_on_new_message: bool = True, max_pending_frames: int = 256):
+        """
+        Initialize a new connection.
+
+        Args:
+            websocket: The accepted websocket.
+            session_id: The session the socket is attached to.
+            cancel_on_new_message: Whether a new user message interrupts the answer in progress (barge-in).
+                When off, answers are queued behind the session lock.
+            max_pending_frames: Frames buffered before senders wait for the socket.
+        """
+        self.websocket = websocket
+        self.session_id = session_id
+        self.cancel_on_new_message = cancel_on_new_message
+        self._outbox: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=max_pending_frames)
+        self._sequence = itertools.count()
+        self._answers: List[asyncio.Task] = []
+        self._closed = False
+
+    async def send(self, payload: Dict[str, Any], control: bool = False, wait: bool = True) -> None:
+        """
+        Queue a frame for the writer.
+
+        Args:
+            payload: The JSON frame.
+            control: Control frames (pong, queue position) are written before pending answer text.
+            wait: Wait until the frame was written to the socket, so callers know what was delivered.
+
+        Raises:
+            WebSocketDisconnect: If the socket is closed.
+        """
+        if self._closed:
+            raise WebSocketDisconnect(code=1006)
+        written = asyncio.get_running_loop().create_future() if wait else None
+        priority = CONTROL_PRIORITY if control else DATA_PRIORITY
+        await self._outbox.put((priority, next(self._sequence), payload, written))
+        if written is not None:
+            await written
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                _, _, payload, written = await self._outbox.get()
+                try:
+                    await self.websocket.send_json(payload)
+                except Exception as e:
+                    if written is not None and not written.done():
+                        written.set_exception(WebSocketDisconnect(code=1006))
+                    logger.info(f"Websocket write failed for session {self.session_id}: {e}")
+                    return
+                if written is not None and not written.done():
+                    written.set_result(None)
+        finally:
+            self._closed = True
+            # Unblock every sender still waiting for its frame
+            while not self._outbox.empty():
+                _, _, _, written = self._outbox.get_nowait()
+                if written is not None and not written.done():
+                    written.set_exception(WebSocketDisconnect(code=1006))
+
+    def _in_flight(self) -> List[asyncio.Task]:
+        self._answers = [task for task in self._answers if not task.done()]
+        return self._answers
+
+    async def cancel_answers(self) -> bool:
+        """
+        Cancel every running or queued answer and wait until their upstream streams are closed.
+        Answer frames not yet written are dropped, so nothing stale follows the cancellation.
+        """
+        tasks = self._in_flight()
+        if not tasks:
+            return False
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        kept = []
+        while not self._outbox.empty():
+            item = self._outbox.get_nowait()
+            if item[0] == CONTROL_PRIORITY:
+                kept.append(item)
+        for item in kept:
+            self._outbox.put_nowait(item)
+        return True
+
+    async def _run_answer(self, answer: Callable[[dict], Awaitable[None]], user_input: dict) -> None:
+        async with get_session_lock(self.session_id):
+            try:
+                await answer(user_input)
+            except WebSocketDisconnect:
+                pass
+            except (ValueError, KeyError) as e:
+                logger.error(f"{e}")
+                await self.send({"error": str(e)})
+                await self.send({"done": True})
+            except Exception as e:
+                # Anything else (e.g. a malformed message) still ends the answer, or the client would hang.
+                # CancelledError is not an Exception: cancellations propagate.
+                logger.exception(f"Answer failed for session {self.session_id}: {e}")
+                await self.send({"error": str(e)})
+                await self.send({"done": True})
+
+    async def run(self, answer: Callable[[dict], Awaitable[None]]) -> None:
+        """
+        Serve the socket until it disconnects.
+
+        Args:
+            answer: Handles one user message, sending its frames with `send`.
+
+        Raises:
+            WebSocketDisconnect: When the client goes away.
+        """
+        writer = asyncio.create_task(self._write())
+        try:
+            while True:
+                data: str = await self.websocket.receive_text()
+                try:
+                    user_input: dict = json.loads(data)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Erreur JSON: {e}")
+                    await self.send({"error": "Erreur de format JSON"}, control=True, wait=False)
+                    continue
+
+                if "ping" in user_input:
+                    await self.send({"pong": user_input["ping"]}, control=True, wait=False)
+                    continue
+
+                if user_input.get("cancel"):
+                    if await self.cancel_answers():
+                        logger.info(f"Generation cancelled by client for session {self.session_id}")
+                        await self.send({"done": True, "cancelled": True}, wait=False)
+                    continue
+
+                if self.cancel_on_new_message and await self.cancel_answers():
+                    # Barge-in: the user interrupted the answer with a new message
+                    logger.info(f"Generation superseded by a new message for session {self.session_id}")
+                    await self.send({"done": True, "cancelled": True}, wait=False)
+                self._answers.append(asyncio.create_task(self._run_answer(answer, user_input)))
+        finally:
+            # Disconnect: stop paying for answers nobody will read
+            if await self.cancel_answers():
+                logger.info(f"Generation cancelled on disconnect for session {self.session_id}")
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
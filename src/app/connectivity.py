@@ -0,0 +1,137 @@
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROBE_TARGETS: List[Tuple[str, int]] = [
+    ("1.1.1.1", 53),  # Cloudflare DNS
+    ("8.8.8.8", 53),  # Google DNS
+    ("api.groq.com", 443)  # Groq API endpoint
+]
+
+
+class ConnectivityMonitor:
+    """Keeps a cached online/offline state, refreshed by a background probe loop."""
+
+    def __init__(
+        self,
+        probe_targets: Optional[List[Tuple[str, int]]] = None,
+        interval: float = 30.0,
+        offline_interval: float = 5.0,
+        probe_timeout: float = 1.5,
+        failure_threshold: int = 2,
+        success_threshold: int = 1
+    ):
+        """
+        Initialize a new connectivity monitor.
+
+        Args:
+            probe_targets: (host, port) pairs probed with a TCP connect.
+            interval: Seconds between probes while online.
+            offline_interval: Seconds between probes while offline, so recovery is noticed quickly.
+            probe_timeout: Timeout in seconds for a single probe round.
+            failure_threshold: Consecutive failures needed to switch to offline.
+            success_threshold: Consecutive successes needed to switch back to online.
+        """
+        self.probe_targets = probe_targets or DEFAULT_PROBE_TARGETS
+        self.interval = interval
+        self.offline_interval = offline_interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = max(1, failure_threshold)
+        self.success_threshold = max(1, success_threshold)
+
+        # Optimistic start: the first real Groq call or probe corrects it
+        self._online = True
+        self._consecutive_failures = 0
+        self._consecutive_successes = 0
+        self._last_change = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    def is_online(self) -> bool:
+        """Return the cached connectivity state. Never does any I/O."""
+        return self._online
+
+    def record_success(self, source: str = "groq") -> None:
+        """Record a successful network operation (probe or real upstream call)."""
+        self._consecutive_failures = 0
+        self._consecutive_successes += 1
+        if not self._online and self._consecutive_successes >= self.success_threshold:
+            self._set_state(True, source)
+
+    def record_failure(self, source: str = "groq") -> None:
+        """Record a failed network operation (probe or real upstream call)."""
+        self._consecutive_successes = 0
+        self._consecutive_failures += 1
+        if self._online and self._consecutive_failures >= self.failure_threshold:
+            self._set_state(False, source)
+
+    def _set_state(self, online: bool, source: str) -> None:
+        self._online = online
+        self._last_change = time.monotonic()
+        if online:
+            logger.info(f"Connectivity restored (detected by {source})")
+        else:
+            logger.error(f"Connectivity lost after {self._consecutive_failures} failures (detected by {source})")
+
+    async def _probe_target(self, host: str, port: int) -> bool:
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), timeout=self.probe_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"Socket connection to {host}:{port} failed: {e}")
+            return False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
+
+    async def probe_once(self) -> bool:
+        """
+        Probe every target concurrently.
+
+        Returns:
+            True as soon as one target accepts a connection, False if all fail.
+        """
+        tasks = [asyncio.create_task(self._probe_target(host, port)) for host, port in self.probe_targets]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                if await next_done:
+                    return True
+            return False
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.probe_once():
+                    self.record_success(source="probe")
+                else:
+                    self.record_failure(source="probe")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Connectivity probe failed unexpectedly: {e}")
+            await asyncio.sleep(self.interval if self._online else self.offline_interval)
+
+    def start(self) -> None:
+        """Start the background probe loop. Must be called from a running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info("Connectivity monitor started")
+
+    async def stop(self) -> None:
+        """Stop the background probe loop."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Connectivity monitor stopped")
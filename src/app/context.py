@@ -0,0 +1,184 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+import re
+
+from app.admission import estimate_tokens
+from app.memory import ChatHistory, MemoryManager, Message
+
+logger = logging.getLogger(__name__)
+
+# (previous summary, transcript to fold in) -> new summary, or None if unavailable
+Summarizer = Callable[[str, str], Awaitable[Optional[str]]]
+
+SUMMARY_HEADING = "Résumé de la conversation précédente : "
+
+FIRST_SENTENCE = re.compile(r"^(.+?[.!?])(\s|$)", re.DOTALL)
+
+
+def render_message(message: Message) -> str:
+    return f"{message.role.capitalize()}: {message.content}"
+
+
+def extractive_summary(previous_summary: str, transcript: List[Message], max_chars: int = 1200) -> str:
+    """
+    Summary used when no LLM summarizer is available: the first sentence of
+    each folded message, appended to the previous summary, keeping the most
+    recent part within max_chars.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for message in transcript:
+        match = FIRST_SENTENCE.match(message.content.strip())
+        sentence = match.group(1) if match else message.content.strip()[:200]
+        lines.append(f"{message.role.capitalize()}: {sentence}")
+    summary = " ".join(lines)
+    return summary[-max_chars:]
+
+
+class ContextManager:
+    """
+    Keeps the conversation history sent to the LLM under a token budget.
+
+    The most recent turns are sent verbatim. Older messages are folded into a
+    rolling summary stored on the ChatHistory. The summary is produced by a
+    background task, off the hot path: until it is ready, messages that no
+    longer fit are simply left out.
+    """
+
+    def __init__(self, memory_manager: MemoryManager, token_budget: int = 1500, keep_turns: int = 6, summarizer: Optional[Summarizer] = None, summary_max_chars: int = 1200):
+        """
+        Initialize a new context manager.
+
+        Args:
+            memory_manager: Where the conversations are stored.
+            token_budget: Maximum estimated tokens of the rendered history (summary included). 0 disables windowing.
+            keep_turns: Maximum user/assistant turns kept verbatim.
+            summarizer: Produces the rolling summary; falls back to an extractive summary.
+            summary_max_chars: Maximum length of the extractive summary.
+        """
+        self.memory_manager = memory_manager
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summarizer = summarizer
+        self.summary_max_chars = summary_max_chars
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.requests = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+        self.summaries = 0
+
+    def window(self, session_id: str, user_query: Optional[str] = None) -> Tuple[str, List[Message]]:
+        """
+        Select the part of a session's history sent to the LLM.
+
+        Args:
+            session_id: The session identifier.
+            user_query: The question being answered. If it is the last message in memory it is
+                left out, since it is sent separately as the user message.
+
+        Returns:
+            The summary of older turns (possibly empty) and the most recent messages, within the token budget.
+        """
+        history = self.memory_manager.get_memory(session_id)
+        messages = history.messages
+        end = len(messages)
+        if end and user_query is not None and messages[-1].role == "user" and messages[-1].content == user_query:
+            end -= 1
+        if not self.token_budget:
+            return "", messages[:end]
+
+        # The summary never takes more than half of the budget (about 4 characters per token)
+        summary = history.summary[-self.token_budget * 2:]
+        budget = self.token_budget - (estimate_tokens(summary) if summary else 0)
+        window_start = max(min(history.summarized, end), end - self.keep_turns * 2)
+
+        recent: List[Message] = []
+        used = 0
+        for message in reversed(messages[window_start:end]):
+            tokens = estimate_tokens(render_message(message))
+            if used + tokens > budget:
+                break
+            recent.append(message)
+            used += tokens
+        recent.reverse()
+        first_kept = end - len(recent)
+
+        if first_kept > history.summarized:
+            self._schedule_summary(history, first_kept)
+
+        full_tokens = sum(estimate_tokens(render_message(message)) for message in messages[:end])
+        sent_tokens = used + (estimate_tokens(summary) if summary else 0)
+        saved = max(0, full_tokens - sent_tokens)
+        self.requests += 1
+        self.tokens_sent += sent_tokens
+        self.tokens_saved += saved
+        logger.info(f"History for session {session_id}: {sent_tokens} tokens sent, {saved} saved")
+        return summary, recent
+
+    def render_history(self, session_id: str, user_query: Optional[str] = None) -> str:
+        """
+        Render the history window of a session as text, for prompts with a {chat_history} slot.
+
+        Returns:
+            The summary of older turns followed by the most recent turns, within the token budget.
+        """
+        summary, recent = self.window(session_id, user_query)
+        parts = [f"{SUMMARY_HEADING}{summary}"] if summary else []
+        parts.extend(render_message(message) for message in recent)
+        return "\n\n".join(parts)
+
+    def _schedule_summary(self, history: ChatHistory, upto: int) -> None:
+        """Fold messages[history.summarized:upto] into the summary in the background."""
+        key = id(history)
+        if key in self._tasks and not self._tasks[key].done():
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._summarize(
+                history, history.messages[history.summarized:upto], history.summary, history.trimmed + upto))
+        except RuntimeError:
+            return
+        self._tasks[key] = task
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def _summarize(self, history: ChatHistory, folded: List[Message], previous_summary: str, folded_until: int) -> None:
+        """
+        Args:
+            folded_until: Position after the last folded message, counting trimmed messages,
+                so it stays valid if older messages are dropped meanwhile.
+        """
+        if not folded:
+            return
+        summary: Optional[str] = None
+        if self.summarizer is not None:
+            transcript = "\n\n".join(render_message(message) for message in folded)
+            try:
+                summary = await self.summarizer(previous_summary, transcript)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Summarization failed, using extractive summary: {e}")
+        if not summary:
+            summary = extractive_summary(previous_summary, folded, self.summary_max_chars)
+
+        history.summary = summary.strip()
+        history.summarized = max(0, folded_until - history.trimmed)
+        self.summaries += 1
+
+    async def stop(self) -> None:
+        """Cancel pending summaries."""
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "token_budget": self.token_budget,
+            "requests": self.requests,
+            "tokens_sent": self.tokens_sent,
+            "tokens_saved": self.tokens_saved,
+            "summaries": self.summaries,
+            "pending_summaries": len(self._background)
+        }
@@ -0,0 +1,58 @@
+from typing import Any, Deque, Dict
+from collections import deque
+
+
+class HedgePolicy:
+    """
+    Decides when a slow chat completion gets a second, hedged request.
+
+    The hedge delay is a percentile of the recently observed times to first
+    token, clamped to [min_delay, max_delay]: with the 95th percentile, about
+    one request in twenty is hedged.
+    """
+
+    def __init__(self, enabled: bool = False, percentile: float = 95.0, min_delay: float = 0.2, max_delay: float = 3.0, min_samples: int = 20, window: int = 500):
+        """
+        Initialize a new hedge policy.
+
+        Args:
+            enabled: Whether hedged requests are sent at all.
+            percentile: Percentile (0-100) of time to first token used as the hedge delay.
+            min_delay: Lower bound of the hedge delay, in seconds.
+            max_delay: Upper bound of the hedge delay, also used until enough samples are collected.
+            min_samples: Samples needed before the percentile is trusted.
+            window: Number of recent samples kept.
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.fired = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+
+    def record(self, time_to_first_token: float) -> None:
+        """Record the time to first token of a completed request."""
+        self._samples.append(time_to_first_token)
+
+    def delay(self) -> float:
+        """The current hedge delay, in seconds."""
+        if len(self._samples) < self.min_samples:
+            return self.max_delay
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return min(self.max_delay, max(self.min_delay, ordered[index]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "delay": self.delay(),
+            "requests": self.requests,
+            "fired": self.fired,
+            "fire_rate": self.fired / self.requests if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins
+        }
@@ -1,9 +1,34 @@
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional, Union
+from array import array
+from collections import OrderedDict
+import asyncio
+import logging
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from enum import Enum
+
+from app.store import InMemoryStore, Record, SessionStore, StoredSession
+
+logger = logging.getLogger(__name__)
+
+class Role(str, Enum):
+    """Sender of a message. Members are singletons, so every message shares the same role object."""
+    USER = "user"
+    AI = "ai"
+    
+    def __str__(self) -> str:
+        return self.value
 
 class Message:
-    """A simple message class for storing chat history."""
+    """
+    A compact message class for storing chat history.
+    
+    Slotted (no per-instance __dict__), with an interned role and an integer
+    timestamp, since tens of thousands of sessions keep their messages in memory.
+    """
+    
+    __slots__ = ("role", "content", "created_ms", "size")
     
     def __init__(self, role: str, content: str):
         """
@@ -13,54 +38,217 @@ class Message:
             role: The role of the sender (user or ai).
             content: The content of the message.
         """
-        self.role = role
+        self.role = Role(role)
         self.content = content
-        self.timestamp = datetime.now()
+        # Milliseconds on the monotonic clock
+        self.created_ms = time.monotonic_ns() // 1_000_000
+        self.size = len(content.encode("utf-8"))
+    
+    @property
+    def timestamp(self) -> datetime:
+        """Wall-clock creation time, derived from the monotonic timestamp."""
+        return datetime.now() - timedelta(milliseconds=time.monotonic_ns() // 1_000_000 - self.created_ms)
+    
+    @classmethod
+    def restore(cls, role: str, content: str, created_ms: int, size: int) -> "Message":
+        """Rebuild a stored message without recomputing its timestamp and size."""
+        message = cls.__new__(cls)
+        message.role = Role(role)
+        message.content = content
+        message.created_ms = created_ms
+        message.size = size
+        return message
     
     def __str__(self) -> str:
         return f"{self.role}: {self.content}"
 
+class ColumnarMessages:
+    """
+    List-like storage of one session's messages as parallel columns.
+    
+    Only the content strings are Python objects; roles, timestamps and sizes
+    are packed in arrays. Message objects are materialized on access.
+    """
+    
+    __slots__ = ("_roles", "_contents", "_created", "_sizes")
+    
+    ROLES = (Role.USER, Role.AI)
+    
+    def __init__(self):
+        self._roles = bytearray()
+        self._contents: List[str] = []
+        self._created = array("q")
+        self._sizes = array("q")
+    
+    def append(self, message: Message) -> None:
+        self._roles.append(self.ROLES.index(message.role))
+        self._contents.append(message.content)
+        self._created.append(message.created_ms)
+        self._sizes.append(message.size)
+    
+    def _get(self, index: int) -> Message:
+        return Message.restore(self.ROLES[self._roles[index]], self._contents[index], self._created[index], self._sizes[index])
+    
+    def __len__(self) -> int:
+        return len(self._contents)
+    
+    def __getitem__(self, index: Union[int, slice]) -> Union[Message, List[Message]]:
+        if isinstance(index, slice):
+            return [self._get(position) for position in range(*index.indices(len(self)))]
+        return self._get(range(len(self))[index])
+    
+    def __delitem__(self, index: slice) -> None:
+        del self._roles[index]
+        del self._contents[index]
+        del self._created[index]
+        del self._sizes[index]
+    
+    def __iter__(self) -> Iterator[Message]:
+        for position in range(len(self)):
+            yield self._get(position)
+
 class ChatHistory:
     """A simple chat history implementation."""
     
-    def __init__(self):
-        """Initialize a new chat history."""
-        self.messages: List[Message] = []
+    def __init__(self, max_messages: int = 0, max_bytes: int = 0, columnar: bool = False):
+        """
+        Initialize a new chat history.
+        
+        Args:
+            max_messages: Maximum number of messages kept; the oldest are dropped. 0 means unlimited.
+            max_bytes: Maximum size of the kept messages in bytes; the oldest are dropped. 0 means unlimited.
+            columnar: Store the messages as columns (ColumnarMessages) instead of a list of objects.
+        """
+        self.columnar = columnar
+        self.messages: Union[List[Message], ColumnarMessages] = ColumnarMessages() if columnar else []
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.trimmed = 0
+        # Rolling summary of the oldest messages, maintained by the ContextManager:
+        # messages[:summarized] are already folded into it
+        self.summary = ""
+        self.summarized = 0
+        # get_history_string() result, rendered on read and valid until the next mutation
+        self._history_string: Optional[str] = None
     
     def add_user_message(self, content: str) -> None:
         """Add a user message to the history."""
-        self.messages.append(Message("user", content))
+        self._append(Message(Role.USER, content))
     
     def add_ai_message(self, content: str) -> None:
         """Add an AI message to the history."""
-        self.messages.append(Message("ai", content))
+        self._append(Message(Role.AI, content))
+    
+    @staticmethod
+    def _render(message: Message) -> str:
+        return f"{message.role.capitalize()}: {message.content}\n\n"
+    
+    def _append(self, message: Message) -> None:
+        self.messages.append(message)
+        self.total_bytes += message.size
+        self._history_string = None
+        # Always keep the newest message, even if it alone exceeds the byte cap
+        drop = 0
+        while len(self.messages) - drop > 1 and (
+                (self.max_messages and len(self.messages) - drop > self.max_messages)
+                or (self.max_bytes and self.total_bytes > self.max_bytes)):
+            self.total_bytes -= self.messages[drop].size
+            drop += 1
+        if drop:
+            del self.messages[:drop]
+            self.trimmed += drop
+            self.summarized = max(0, self.summarized - drop)
+    
+    @property
+    def next_seq(self) -> int:
+        """Position of the next message, counting the trimmed ones."""
+        return self.trimmed + len(self.messages)
+    
+    def load(self, stored: StoredSession) -> None:
+        """Restore the messages and summary of a session loaded from a SessionStore."""
+        for record in stored.records:
+            self._append(Message.restore(*record))
+        self.trimmed += stored.first_seq
+        self.summary = stored.summary
+        self.summarized = max(0, min(len(self.messages), stored.summarized - self.trimmed))
     
     def clear(self) -> None:
         """Clear the chat history."""
-        self.messages = []
+        self.messages = ColumnarMessages() if self.columnar else []
+        self.total_bytes = 0
+        self.summary = ""
+        self.summarized = 0
+        self._history_string = None
     
     def get_history_string(self) -> str:
-        """Get the chat history as a string."""
-        if not self.messages:
-            return ""
-        
-        history_str = ""
-        for msg in self.messages:
-            history_str += f"{msg.role.capitalize()}: {msg.content}\n\n"
+        """
+        Get the chat history as a string.
         
-        return history_str.strip()
+        The history is rendered in one pass on the first read and the result is
+        cached until the next mutation, so appending a message never copies the
+        transcript and nothing is kept for sessions that are never rendered.
+        """
+        if self._history_string is None:
+            self._history_string = "".join(self._render(message) for message in self.messages).strip()
+        return self._history_string
 
 class MemoryManager:
     """Manages conversation memory for multiple users."""
     
-    def __init__(self):
-        # Dictionary to store conversation memory by session_id
-        self.memories: Dict[str, ChatHistory] = {}
+    def __init__(
+        self,
+        session_ttl: float = 3600.0,
+        max_sessions: int = 10000,
+        max_total_bytes: int = 256 * 1024 * 1024,
+        session_max_messages: int = 50,
+        session_max_bytes: int = 64 * 1024,
+        columnar: bool = False,
+        store: Optional[SessionStore] = None,
+        revalidate_after: float = 2.0
+    ):
+        """
+        Initialize a new memory manager.
+        
+        Args:
+            session_ttl: Seconds of inactivity after which a session is evicted. 0 disables the TTL.
+            max_sessions: Maximum number of sessions; the least recently used are evicted. 0 means unlimited.
+            max_total_bytes: Global budget for message content; the least recently used sessions are evicted. 0 means unlimited.
+            session_max_messages: Maximum messages kept per session. 0 means unlimited.
+            session_max_bytes: Maximum message bytes kept per session. 0 means unlimited.
+            columnar: Store each session's messages as columns, which is more compact.
+            store: Where sessions are persisted. The sessions kept here act as its read cache. Defaults to no persistence.
+            revalidate_after: Seconds after which prepare() checks a cached session against a shared store,
+                in case another worker added messages to it.
+        """
+        # Conversation memory by session_id, least recently used first
+        self.memories: "OrderedDict[str, ChatHistory]" = OrderedDict()
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.max_total_bytes = max_total_bytes
+        self.session_max_messages = session_max_messages
+        self.session_max_bytes = session_max_bytes
+        self.columnar = columnar
+        self.store = store or InMemoryStore()
+        self.revalidate_after = revalidate_after
+        self.total_bytes = 0
+        self._last_access: Dict[str, float] = {}
+        self._validated: Dict[str, float] = {}
+        self.loaded_sessions = 0
+        self.stale_sessions = 0
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        self.evicted_bytes = 0
+        self.trimmed_messages = 0
     
     def get_memory(self, session_id: Optional[str] = None) -> ChatHistory:
         """
         Get or create memory for a specific session.
         
+        A session that is not cached is loaded from the store on the calling
+        thread. Requests should call prepare() first, which does the store
+        reads on a worker thread and revalidates cached sessions.
+        
         Args:
             session_id: The unique identifier for the session. If None, a new session is created.
             
@@ -70,10 +258,95 @@ class MemoryManager:
         if session_id is None:
             session_id = str(uuid.uuid4())
         
+        self.evict_expired()
+        memory = self.memories.get(session_id)
+        if memory is None:
+            memory = self._install(session_id, self.store.load(session_id))
+        else:
+            self.memories.move_to_end(session_id)
+        self._last_access[session_id] = time.monotonic()
+        
+        return memory
+    
+    async def prepare(self, session_id: str) -> None:
+        """
+        Load or revalidate a session ahead of a request, off the event loop.
+        
+        With a shared store, a cached session not checked for revalidate_after
+        seconds is compared with the store, and reloaded if another worker
+        changed or cleared it. The store reads (a version lookup, and a load
+        when the session is not cached or is stale) run on a worker thread,
+        so a store slowed down by other workers' writes does not stall every
+        websocket; the get_memory calls of the request then find the session cached.
+        
+        Args:
+            session_id: The session identifier.
+        """
+        if not self.store.shared:
+            return
+        self.evict_expired()
+        loop = asyncio.get_running_loop()
+        memory = self.memories.get(session_id)
+        if memory is not None:
+            if time.monotonic() - self._validated.get(session_id, 0.0) < self.revalidate_after:
+                return
+            next_seq = memory.next_seq
+            version = await loop.run_in_executor(None, self.store.version, session_id)
+            if self.memories.get(session_id) is not memory or memory.next_seq != next_seq:
+                # Changed here meanwhile: it is checked again on the next request
+                return
+            self._validated[session_id] = time.monotonic()
+            if version is None or version == next_seq:
+                return
+            # Another worker changed or cleared the session: reload it
+            self._remove(session_id)
+            self.stale_sessions += 1
+        stored = await loop.run_in_executor(None, self.store.load, session_id)
         if session_id not in self.memories:
-            self.memories[session_id] = ChatHistory()
+            self._install(session_id, stored)
+    
+    def _install(self, session_id: str, stored: Optional[StoredSession]) -> ChatHistory:
+        memory = ChatHistory(
+            max_messages=self.session_max_messages, max_bytes=self.session_max_bytes, columnar=self.columnar)
+        if stored is not None:
+            memory.load(stored)
+            self.loaded_sessions += 1
+        self.memories[session_id] = memory
+        self.total_bytes += memory.total_bytes
+        self._validated[session_id] = self._last_access[session_id] = time.monotonic()
+        self._enforce_limits(keep=session_id)
+        return memory
+    
+    def restore(self, session_id: str, stored: StoredSession, idle: float = 0.0) -> None:
+        """
+        Put a saved session back in memory (used for warm restarts).
         
-        return self.memories[session_id]
+        Args:
+            session_id: The session identifier.
+            stored: The saved messages and summary.
+            idle: Seconds since the session was last used.
+        """
+        memory = ChatHistory(
+            max_messages=self.session_max_messages, max_bytes=self.session_max_bytes, columnar=self.columnar)
+        memory.load(stored)
+        if session_id in self.memories:
+            self._remove(session_id)
+        self.memories[session_id] = memory
+        self.total_bytes += memory.total_bytes
+        self._last_access[session_id] = time.monotonic() - idle
+        self._enforce_limits(keep=session_id)
+    
+    def idle_time(self, session_id: str) -> float:
+        """Seconds since a session was last used."""
+        return time.monotonic() - self._last_access.get(session_id, time.monotonic())
+    
+    async def has_session(self, session_id: str) -> bool:
+        """Whether a session still has memory, here or in the store, without creating it."""
+        self.evict_expired()
+        if session_id in self.memories:
+            return True
+        loop = asyncio.get_running_loop()
+        return bool(await loop.run_in_executor(None, self.store.version, session_id))
     
     def add_user_message(self, session_id: str, message: str) -> None:
         """
@@ -84,7 +357,9 @@ class MemoryManager:
             message: The user's message.
         """
         memory = self.get_memory(session_id)
+        before_bytes, before_trimmed = memory.total_bytes, memory.trimmed
         memory.add_user_message(message)
+        self._account(session_id, memory, before_bytes, before_trimmed)
     
     def add_ai_message(self, session_id: str, message: str) -> None:
         """
@@ -95,7 +370,19 @@ class MemoryManager:
             message: The AI's message.
         """
         memory = self.get_memory(session_id)
+        before_bytes, before_trimmed = memory.total_bytes, memory.trimmed
         memory.add_ai_message(message)
+        self._account(session_id, memory, before_bytes, before_trimmed)
+    
+    def _account(self, session_id: str, memory: ChatHistory, before_bytes: int, before_trimmed: int) -> None:
+        self.total_bytes += memory.total_bytes - before_bytes
+        self.trimmed_messages += memory.trimmed - before_trimmed
+        message = memory.messages[-1]
+        self.store.append(
+            session_id, memory.next_seq - 1,
+            Record(message.role.value, message.content, message.created_ms, message.size),
+            memory.trimmed, memory.summary, memory.trimmed + memory.summarized)
+        self._enforce_limits(keep=session_id)
     
     def get_chat_history(self, session_id: str) -> str:
         """
@@ -118,4 +405,65 @@ class MemoryManager:
             session_id: The session identifier.
         """
         if session_id in self.memories:
-            self.memories[session_id].clear() 
\ No newline at end of file
+            self._remove(session_id)
+        self.store.delete(session_id)
+    
+    def _remove(self, session_id: str) -> None:
+        memory = self.memories.pop(session_id)
+        self._last_access.pop(session_id, None)
+        self._validated.pop(session_id, None)
+        self.total_bytes -= memory.total_bytes
+    
+    def evict_expired(self) -> int:
+        """
+        Evict the sessions idle for longer than the TTL.
+        Sessions are kept in access order, so only the expired ones are visited.
+        
+        Returns:
+            The number of evicted sessions.
+        """
+        if not self.session_ttl:
+            return 0
+        deadline = time.monotonic() - self.session_ttl
+        evicted = 0
+        while self.memories:
+            oldest = next(iter(self.memories))
+            if self._last_access.get(oldest, 0.0) > deadline:
+                break
+            self._remove(oldest)
+            evicted += 1
+        self.evicted_idle += evicted
+        return evicted
+    
+    def _enforce_limits(self, keep: Optional[str] = None) -> None:
+        """Evict least recently used sessions (never `keep`) until the session count and byte budget are met."""
+        while len(self.memories) > 1:
+            over_sessions = self.max_sessions and len(self.memories) > self.max_sessions
+            over_bytes = self.max_total_bytes and self.total_bytes > self.max_total_bytes
+            if not over_sessions and not over_bytes:
+                break
+            oldest = next(iter(self.memories))
+            if oldest == keep:
+                break
+            self._remove(oldest)
+            if over_sessions:
+                self.evicted_lru += 1
+            else:
+                self.evicted_bytes += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.memories),
+            "total_bytes": self.total_bytes,
+            "evicted_idle": self.evicted_idle,
+            "evicted_lru": self.evicted_lru,
+            "evicted_bytes": self.evicted_bytes,
+            "trimmed_messages": self.trimmed_messages,
+            "loaded_sessions": self.loaded_sessions,
+            "stale_sessions": self.stale_sessions,
+            "store": self.store.stats()
+        }
+    
+    def close(self) -> None:
+        """Write pending changes to the store (called on shutdown)."""
+        self.store.close()
@@ -0,0 +1,132 @@
+from typing import Any, Dict, FrozenSet, List, Tuple
+import logging
+import re
+
+from app.admission import estimate_tokens
+from app.retrieval import Passage, tokenize
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Tokens taken by the "[source] " header and the blank line between passages
+PASSAGE_OVERHEAD = 4
+
+
+def shingles(text: str, size: int = 3) -> FrozenSet[Tuple[str, ...]]:
+    """Word n-grams of a text, to compare passages."""
+    terms = tokenize(text)
+    if len(terms) < size:
+        return frozenset([tuple(terms)]) if terms else frozenset()
+    return frozenset(tuple(terms[index:index + size]) for index in range(len(terms) - size + 1))
+
+
+def similarity(first: FrozenSet[Tuple[str, ...]], second: FrozenSet[Tuple[str, ...]]) -> float:
+    """Jaccard similarity of two shingle sets."""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def trim_to_sentences(text: str, max_tokens: int) -> str:
+    """
+    Shorten a text to the leading whole sentences that fit in max_tokens.
+
+    If not even the first sentence fits, it is cut at a word boundary.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = SENTENCE_END.split(text.strip())
+    kept: List[str] = []
+    for sentence in sentences:
+        candidate = " ".join(kept + [sentence])
+        if estimate_tokens(candidate) > max_tokens:
+            break
+        kept.append(sentence)
+    if kept:
+        return " ".join(kept)
+    cut = sentences[0][:max_tokens * 4].rsplit(" ", 1)[0]
+    return f"{cut}…" if cut else ""
+
+
+class ContextPacker:
+    """
+    Fits retrieved passages into a token budget for the {rag_document} slot.
+
+    Candidates are taken best first. Near-duplicates of a passage already
+    packed are skipped, passages are trimmed to whole sentences, and a
+    passage that does not fit is shortened to the remaining budget when
+    enough of it is left.
+    """
+
+    def __init__(self, token_budget: int = 600, duplicate_threshold: float = 0.6, min_tokens: int = 40):
+        """
+        Initialize a new packer.
+
+        Args:
+            token_budget: Estimated tokens of passages per prompt.
+            duplicate_threshold: Shingle similarity above which a passage is a near-duplicate.
+            min_tokens: Smallest remaining budget worth filling with a shortened passage.
+        """
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.min_tokens = min_tokens
+        self.requests = 0
+        self.packed_tokens = 0
+        self.candidate_tokens = 0
+        self.duplicates = 0
+        self.trimmed = 0
+        self.dropped = 0
+
+    def pack(self, results: List[Tuple[Passage, float]]) -> List[Tuple[Passage, float]]:
+        """
+        Choose and trim passages.
+
+        Args:
+            results: Retrieved (passage, score) pairs, best first.
+
+        Returns:
+            The packed (passage, score) pairs, best first, within the budget.
+        """
+        packed: List[Tuple[Passage, float]] = []
+        packed_shingles: List[FrozenSet[Tuple[str, ...]]] = []
+        remaining = self.token_budget
+        candidate_tokens = 0
+        for passage, score in results:
+            candidate_tokens += estimate_tokens(passage.text) + PASSAGE_OVERHEAD
+            available = remaining - PASSAGE_OVERHEAD
+            if available < self.min_tokens:
+                self.dropped += 1
+                continue
+            passage_shingles = shingles(passage.text)
+            if any(similarity(passage_shingles, other) >= self.duplicate_threshold for other in packed_shingles):
+                self.duplicates += 1
+                continue
+            text = trim_to_sentences(passage.text, available)
+            if not text:
+                self.dropped += 1
+                continue
+            if text != passage.text:
+                self.trimmed += 1
+            packed.append((passage._replace(text=text), score))
+            packed_shingles.append(passage_shingles)
+            remaining = available - estimate_tokens(text)
+
+        tokens = self.token_budget - remaining
+        self.requests += 1
+        self.packed_tokens += tokens
+        self.candidate_tokens += candidate_tokens
+        logger.info(
+            f"Packed {len(packed)}/{len(results)} passages: {tokens} tokens "
+            f"(budget {self.token_budget}, {candidate_tokens} retrieved)")
+        return packed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "token_budget": self.token_budget,
+            "requests": self.requests,
+            "average_packed_tokens": self.packed_tokens / self.requests if self.requests else 0.0,
+            "average_retrieved_tokens": self.candidate_tokens / self.requests if self.requests else 0.0,
+            "duplicates": self.duplicates,
+            "trimmed": self.trimmed,
+            "dropped": self.dropped
+        }
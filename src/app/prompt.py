@@ -1,3 +1,10 @@
+from functools import lru_cache
+import hashlib
+import re
+
+# Bump this whenever a template changes, so cached answers built from the old prompts are ignored
+PROMPT_VERSION = "1"
+
 PROMPT_TEMPLATE = """
 Tu es PSG Fan Assistant. Aide les utilisateurs avec:
 * Prédictions de matchs
@@ -43,3 +50,28 @@ Important: Ne jamais encourager les paris irresponsables.
 
 Ressources: {rag_document}
 """
+
+PROMPT_SUMMARY = """
+Tu résumes une conversation entre un utilisateur et PSG Fan Assistant.
+Mets à jour le résumé existant avec les nouveaux échanges, en quelques phrases.
+Garde les faits utiles pour la suite: préférences, niveau de l'utilisateur, questions posées, réponses importantes.
+Réponds uniquement avec le résumé.
+"""
+
+
+# Per-request slots: in "messages" assembly they are sent as separate messages
+# after the static prefix, so the prefix stays byte-identical across requests
+TEMPLATE_SLOTS = ("{chat_history}", "{rag_document}")
+
+
+@lru_cache(maxsize=64)
+def static_prefix(template: str) -> str:
+    """The template without the lines holding per-request slots."""
+    lines = [line for line in template.splitlines() if not any(slot in line for slot in TEMPLATE_SLOTS)]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+@lru_cache(maxsize=64)
+def prefix_hash(template: str) -> str:
+    """Short hash of the static prefix, to measure how often a prefix is reused."""
+    return hashlib.sha256(static_prefix(template).encode("utf-8")).hexdigest()[:16]
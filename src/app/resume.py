@@ -0,0 +1,78 @@
+from typing import Any, Dict, Optional, Tuple
+import base64
+import binascii
+import hashlib
+import hmac
+import secrets
+import time
+
+RESUMED = "resumed"
+INVALID = "invalid"
+EXPIRED = "expired"
+
+
+class ResumeTokens:
+    """
+    Signed tokens that let a reconnecting client reattach to its session.
+
+    A token carries the session id, the endpoint and its issue time, signed
+    with HMAC-SHA256. Nothing is stored server-side, so any worker sharing
+    the secret can verify it.
+    """
+
+    def __init__(self, secret: Optional[str] = None, max_age: float = 86400.0):
+        """
+        Initialize the token issuer.
+
+        Args:
+            secret: Signing key, shared by every worker. A random key is used if not set,
+                so tokens are then only valid for this process.
+            max_age: Seconds during which a token can be used.
+        """
+        self._key = (secret or secrets.token_hex(32)).encode("utf-8")
+        self.max_age = max_age
+        self.issued = 0
+        self.resumed = 0
+        self.expired = 0
+        self.invalid = 0
+
+    def _sign(self, payload: bytes) -> str:
+        return hmac.new(self._key, payload, hashlib.sha256).hexdigest()[:32]
+
+    def issue(self, session_id: str, endpoint: str) -> str:
+        """Create a resume token for a session opened on an endpoint."""
+        payload = f"{session_id}:{endpoint}:{int(time.time())}".encode("utf-8")
+        self.issued += 1
+        return f"{base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')}.{self._sign(payload)}"
+
+    def verify(self, token: str, endpoint: str) -> Tuple[Optional[str], str]:
+        """
+        Check a resume token.
+
+        Returns:
+            The session id (None unless the token is valid) and the outcome: RESUMED, INVALID or EXPIRED.
+        """
+        try:
+            encoded, signature = token.split(".", 1)
+            payload = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+            session_id, token_endpoint, issued_at = payload.decode("utf-8").rsplit(":", 2)
+            issued_at = int(issued_at)
+        except (ValueError, binascii.Error, UnicodeDecodeError):
+            self.invalid += 1
+            return None, INVALID
+        expected = self._sign(payload).encode("ascii")
+        if not hmac.compare_digest(signature.encode("utf-8", "replace"), expected) or token_endpoint != endpoint:
+            self.invalid += 1
+            return None, INVALID
+        if time.time() - issued_at > self.max_age:
+            self.expired += 1
+            return None, EXPIRED
+        return session_id, RESUMED
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "issued": self.issued,
+            "resumed": self.resumed,
+            "expired": self.expired,
+            "invalid": self.invalid
+        }
@@ -0,0 +1,375 @@
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+from collections import Counter
+import asyncio
+import hashlib
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from app.utils import get_file_list, iter_json_content
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+a au aux avec ce ces cet cette dans de des du elle en est et eux il ils je la le les leur leurs lui ma mais me
+meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sont sur ta te tes toi ton tu un une
+vos votre vous y c d j l m n s t
+the of and to in is it that for on with as at by an be this are or from was
+""".split())
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents, so "Équipe" and "equipe" match."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into index terms: normalized words without stopwords."""
+    return [word for word in WORD.findall(normalize(text)) if word not in STOPWORDS]
+
+
+class Passage(NamedTuple):
+    """A chunk of a knowledge document."""
+    source: str
+    text: str
+
+
+def json_to_text(value: Any, prefix: str = "") -> List[str]:
+    """Flatten a JSON document into "key: value" lines, keeping the key path for context."""
+    if isinstance(value, dict):
+        lines = []
+        for key, item in value.items():
+            lines.extend(json_to_text(item, f"{prefix}{key}: " if not isinstance(item, (dict, list)) else f"{prefix}{key} > "))
+        return lines
+    if isinstance(value, list):
+        lines = []
+        for item in value:
+            lines.extend(json_to_text(item, prefix))
+        return lines
+    if value is None or value == "":
+        return []
+    return [f"{prefix}{value}"]
+
+
+def chunk_lines(lines: Iterable[str], max_words: int = 120, overlap: int = 30) -> List[str]:
+    """
+    Split lines into passages of max_words words.
+
+    Each line ends with a sentence boundary. Consecutive passages share
+    `overlap` words, so an answer straddling two passages is still found.
+    """
+    words: List[str] = []
+    for line in lines:
+        words.extend(line.split())
+        # Line boundaries become sentence boundaries
+        if words and not words[-1].endswith((".", "!", "?", ":")):
+            words[-1] += "."
+    if not words:
+        return []
+    step = max(1, max_words - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + max_words]))
+        if start + max_words >= len(words):
+            break
+    return chunks
+
+
+def passage_terms(passage: Passage) -> Counter:
+    """Term frequencies of a passage, as indexed."""
+    return Counter(tokenize(f"{passage.source} {passage.text}"))
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring."""
+
+    def __init__(self, passages: List[Passage], k1: float = 1.5, b: float = 0.75, term_counts: Optional[List[Counter]] = None):
+        """
+        Build the index.
+
+        Args:
+            passages: The passages to index.
+            k1: Term frequency saturation.
+            b: Length normalization.
+            term_counts: passage_terms of each passage, if already known.
+        """
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        # term -> [(passage index, term frequency)]
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+        for index, passage in enumerate(passages):
+            counts = term_counts[index] if term_counts is not None else passage_terms(passage)
+            self.lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings.setdefault(term, []).append((index, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        # Per-passage length normalization, computed once
+        self.norms = [self.k1 * (1 - self.b + self.b * length / self.average_length) for length in self.lengths]
+        count = len(passages)
+        self.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[Passage, float]]:
+        """
+        Find the passages most relevant to a query.
+
+        Returns:
+            Up to k (passage, score) pairs, best first.
+        """
+        scores: Dict[int, float] = {}
+        norms = self.norms
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            weight = self.idf[term] * (self.k1 + 1)
+            for index, frequency in postings:
+                scores[index] = scores.get(index, 0.0) + weight * frequency / (frequency + norms[index])
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.passages[index], score) for index, score in best]
+
+
+def fuse_rankings(rankings: List[List[Tuple[Passage, float]]], k: int, constant: int = 60) -> List[Tuple[Passage, float]]:
+    """Combine rankings with reciprocal rank fusion: a passage scores sum(1 / (constant + rank))."""
+    scores: Dict[Passage, float] = {}
+    for ranking in rankings:
+        for rank, (passage, _) in enumerate(ranking, start=1):
+            scores[passage] = scores.get(passage, 0.0) + 1.0 / (constant + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class DocumentState(NamedTuple):
+    """What the knowledge base knows of one document file."""
+    mtime_ns: int
+    size: int
+    digest: str
+    passages: List[Passage]
+    term_counts: List[Counter]
+
+
+class IndexGeneration(NamedTuple):
+    """An immutable version of the index, replaced as a whole when documents change."""
+    number: int
+    index: BM25Index
+    passages: FrozenSet[Passage]
+
+
+class KnowledgeBase:
+    """
+    The JSON knowledge documents, chunked and indexed for retrieval.
+
+    Used to fill the {rag_document} slot of the course and evaluation prompts.
+    When a dense vector index is attached, its ranking is fused with BM25's.
+
+    The directory is polled for changes: only new or modified files (by
+    mtime and size, then content hash) are parsed and tokenized again, and
+    the rebuilt index is swapped in as a new generation. A request keeps the
+    generation it started with, so updates never show half-applied.
+    """
+
+    def __init__(self, directory: str, top_k: int = 3, chunk_words: int = 120, chunk_overlap: int = 30, reload_interval: float = 0.0):
+        """
+        Initialize the knowledge base.
+
+        Args:
+            directory: Directory of the JSON documents.
+            top_k: Passages returned per query.
+            chunk_words: Words per passage.
+            chunk_overlap: Words shared by consecutive passages.
+            reload_interval: Seconds between two checks of the directory for changes. 0 only loads on startup.
+        """
+        self.directory = directory
+        self.top_k = top_k
+        self.chunk_words = chunk_words
+        self.chunk_overlap = chunk_overlap
+        self.reload_interval = reload_interval
+        self.generation = IndexGeneration(0, BM25Index([]), frozenset())
+        # Optional dense index (app.vectors.VectorIndex), with a search(query, k) method
+        self.vectors: Optional[Any] = None
+        self._documents: Dict[str, DocumentState] = {}
+        self._refresh_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.queries = 0
+        self.query_time = 0.0
+        self.reloads = 0
+        self.parsed = 0
+        self.parse_errors = 0
+
+    @property
+    def index(self) -> BM25Index:
+        return self.generation.index
+
+    def _chunk(self, name: str, document: Any) -> List[Passage]:
+        source = os.path.splitext(name)[0]
+        return [Passage(source, text) for text in chunk_lines(json_to_text(document), self.chunk_words, self.chunk_overlap)]
+
+    def load_passages(self) -> List[Passage]:
+        """Read and chunk every JSON document of the directory. Unreadable files are skipped."""
+        passages = []
+        # Streamed without caching: this full read is for the offline vector build
+        for name, document in iter_json_content(self.directory, cache=False):
+            passages.extend(self._chunk(name, document))
+        return passages
+
+    def load(self) -> None:
+        """Build the index from the directory (called on startup)."""
+        if not os.path.isdir(self.directory):
+            logger.info(f"No knowledge directory {self.directory}, retrieval disabled")
+            return
+        self.refresh()
+
+    def _document_state(self, name: str, document: Any, status: os.stat_result, previous: Optional[DocumentState]) -> DocumentState:
+        """Chunk a parsed document; its passages are tokenized again only if their text changed."""
+        passages = self._chunk(name, document)
+        digest = hashlib.sha256("\n".join(passage.text for passage in passages).encode("utf-8")).hexdigest()
+        if previous is not None and previous.digest == digest:
+            # Touched, or edited without changing the indexed text: nothing to re-index
+            return previous._replace(mtime_ns=status.st_mtime_ns, size=status.st_size)
+        self.parsed += 1
+        return DocumentState(status.st_mtime_ns, status.st_size, digest, passages, [passage_terms(passage) for passage in passages])
+
+    def refresh(self) -> bool:
+        """
+        Re-index the documents that were added, modified or removed since the last refresh.
+
+        Files whose modification time or size changed are read and parsed
+        on the thread pool of iter_json_content. Blocking: called from a
+        worker thread.
+
+        Returns:
+            Whether a new index generation was swapped in.
+        """
+        with self._refresh_lock:
+            started = time.monotonic()
+            if not os.path.isdir(self.directory):
+                return False
+            try:
+                names = sorted(name for name in get_file_list(self.directory) if name.endswith(".json"))
+            except OSError as e:
+                logger.error(f"Could not list knowledge directory {self.directory}: {e}")
+                return False
+            documents: Dict[str, DocumentState] = {}
+            statuses: Dict[str, os.stat_result] = {}
+            for name in names:
+                previous = self._documents.get(name)
+                try:
+                    status = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.error(f"Could not read knowledge document {name}: {e}")
+                    if previous is not None:
+                        documents[name] = previous
+                    continue
+                if previous is not None and (previous.mtime_ns, previous.size) == (status.st_mtime_ns, status.st_size):
+                    documents[name] = previous
+                else:
+                    statuses[name] = status
+
+            # The parsed documents are only chunked, so they are not kept in the JSON cache
+            errors: List[Tuple[str, Exception]] = []
+            for name, document in iter_json_content(self.directory, cache=False, errors=errors, names=list(statuses)):
+                documents[name] = self._document_state(name, document, statuses[name], self._documents.get(name))
+            for name, error in errors:
+                if isinstance(error, FileNotFoundError):
+                    continue
+                # Often a file caught mid-write: keep serving the previous version until it parses
+                self.parse_errors += 1
+                previous = self._documents.get(name)
+                status = statuses[name]
+                if previous is not None:
+                    documents[name] = previous._replace(mtime_ns=status.st_mtime_ns, size=status.st_size)
+                else:
+                    documents[name] = DocumentState(status.st_mtime_ns, status.st_size, "", [], [])
+
+            documents = {name: documents[name] for name in sorted(documents)}
+            changed = sum(
+                1 for name, state in documents.items()
+                if name not in self._documents or state.digest != self._documents[name].digest)
+            removed = len(self._documents.keys() - documents.keys())
+            self._documents = documents
+            if not changed and not removed:
+                return False
+
+            passages: List[Passage] = []
+            term_counts: List[Counter] = []
+            for state in documents.values():
+                passages.extend(state.passages)
+                term_counts.extend(state.term_counts)
+            index = BM25Index(passages, term_counts=term_counts)
+            self.generation = IndexGeneration(self.generation.number + 1, index, frozenset(passages))
+            self.reloads += 1
+            logger.info(
+                f"Knowledge generation {self.generation.number}: {changed} documents changed, {removed} removed, "
+                f"{len(passages)} passages from {self.directory} in {time.monotonic() - started:.2f}s")
+            return True
+
+    def start(self) -> None:
+        """Start watching the directory for changes."""
+        if self.reload_interval and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await loop.run_in_executor(None, self.refresh)
+            except Exception as e:
+                logger.error(f"Knowledge reload failed: {e}")
+
+    async def stop(self) -> None:
+        """Stop watching the directory."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def retrieve(self, query: str, k: int = 0) -> List[Tuple[Passage, float]]:
+        """The k (default top_k) most relevant passages for a query, best first."""
+        started = time.perf_counter()
+        k = k or self.top_k
+        generation = self.generation
+        if self.vectors is None:
+            results = generation.index.search(query, k)
+        else:
+            # Dig deeper in each ranking so the fusion has candidates to agree on
+            depth = k * 4
+            # The vector index is rebuilt offline: drop passages edited since
+            dense = [(passage, score) for passage, score in self.vectors.search(query, depth) if passage in generation.passages]
+            results = fuse_rankings([generation.index.search(query, depth), dense], k)
+        self.queries += 1
+        self.query_time += time.perf_counter() - started
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        generation = self.generation
+        return {
+            "generation": generation.number,
+            "documents": len(self._documents),
+            "passages": len(generation.index.passages),
+            "terms": len(generation.index.postings),
+            "vector_passages": len(self.vectors.passages) if self.vectors is not None else 0,
+            "reloads": self.reloads,
+            "parsed": self.parsed,
+            "parse_errors": self.parse_errors,
+            "queries": self.queries,
+            "average_query_ms": 1000 * self.query_time / self.queries if self.queries else 0.0
+        }
+
+
+def format_passages(results: List[Tuple[Passage, float]]) -> str:
+    """Render retrieved passages for the {rag_document} slot."""
+    return "\n\n".join(f"[{passage.source}] {passage.text}" for passage, _ in results)
@@ -0,0 +1,114 @@
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def make_flight_key(messages: List[Dict[str, str]], model: str) -> str:
+    """Key identical upstream requests: same model and byte-identical messages."""
+    raw = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One upstream stream shared by every subscriber with the same key."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.condition = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class StreamCoalescer:
+    """
+    Single-flight for streamed completions.
+
+    The first request for a key becomes the leader and opens the upstream
+    stream; concurrent requests with the same key subscribe to it instead.
+    Every subscriber receives all chunks from the beginning, including the
+    ones streamed before it joined.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncGenerator[str, None]:
+        """
+        Stream the chunks for a key, sharing the upstream with concurrent callers.
+
+        Args:
+            key: The request key, e.g. from make_flight_key.
+            factory: Opens the upstream stream. Only called by the leader.
+
+        Yields:
+            The upstream chunks. Upstream errors are raised to every subscriber.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            logger.info(f"Joining in-flight upstream request ({flight.subscribers} already waiting)")
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                async with flight.condition:
+                    await flight.condition.wait_for(lambda: index < len(flight.chunks) or flight.done)
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done and flight.task is not None:
+                # Nobody is listening any more: stop paying for the upstream stream. The flight
+                # is unpublished first, so an identical request starts a new one instead of joining it.
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+                # Wait for the upstream stream to be closed, so the caller knows it is released
+                await asyncio.wait([flight.task])
+
+    async def _run(self, key: str, flight: _Flight, factory: Callable[[], AsyncIterator[str]]) -> None:
+        stream = factory()
+        try:
+            async for chunk in stream:
+                flight.chunks.append(chunk)
+                async with flight.condition:
+                    flight.condition.notify_all()
+        except asyncio.CancelledError:
+            # Subscribers must not receive a CancelledError they did not cause: it would cancel them
+            flight.error = RuntimeError("The shared upstream stream was cancelled")
+        except Exception as e:
+            flight.error = e
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            async with flight.condition:
+                flight.condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
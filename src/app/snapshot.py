@@ -0,0 +1,224 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import struct
+import time
+import zlib
+
+from app.memory import ColumnarMessages, MemoryManager
+from app.store import Record, StoredSession
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BTMEM\x02"
+
+# After the magic, uncompressed: wall-clock time of the snapshot, so downtime counts as idle time
+FILE_HEADER = struct.Struct("<d")
+# Per session: session_id length, idle seconds, first position, summarized position, summary length, message count
+SESSION_HEADER = struct.Struct("<HdQQII")
+# Per message: role, age in milliseconds, content length
+MESSAGE_HEADER = struct.Struct("<BqI")
+ROLES = ColumnarMessages.ROLES
+
+
+def _encode_sessions(memory_manager: MemoryManager, session_ids: List[str]) -> bytes:
+    """Serialize a batch of sessions (on the event loop, where sessions are safe to read)."""
+    now_ms = time.monotonic_ns() // 1_000_000
+    parts: List[bytes] = []
+    for session_id in session_ids:
+        memory = memory_manager.memories.get(session_id)
+        if memory is None:
+            continue
+        encoded_id = session_id.encode("utf-8")
+        summary = memory.summary.encode("utf-8")
+        idle = memory_manager.idle_time(session_id)
+        parts.append(SESSION_HEADER.pack(
+            len(encoded_id), idle, memory.trimmed, memory.trimmed + memory.summarized, len(summary), len(memory.messages)))
+        parts.append(encoded_id)
+        parts.append(summary)
+        for message in memory.messages:
+            content = message.content.encode("utf-8")
+            parts.append(MESSAGE_HEADER.pack(ROLES.index(message.role), now_ms - message.created_ms, len(content)))
+            parts.append(content)
+    return b"".join(parts)
+
+
+def decode_snapshot(data: bytes) -> List[Tuple[str, float, StoredSession]]:
+    """
+    Parse a snapshot file.
+
+    Idle times and message ages include the wall-clock time elapsed since
+    the snapshot was written, e.g. while the server was down.
+
+    Returns:
+        (session_id, idle seconds, session) in least recently used first order.
+
+    Raises:
+        ValueError: If the file is not a snapshot or is corrupted.
+    """
+    if not data.startswith(MAGIC) or len(data) < len(MAGIC) + FILE_HEADER.size:
+        raise ValueError("Not a memory snapshot")
+    written_at, = FILE_HEADER.unpack_from(data, len(MAGIC))
+    elapsed = max(0.0, time.time() - written_at)
+    try:
+        payload = zlib.decompress(data[len(MAGIC) + FILE_HEADER.size:])
+    except zlib.error as e:
+        raise ValueError(f"Corrupted memory snapshot: {e}")
+    now_ms = time.monotonic_ns() // 1_000_000 - int(elapsed * 1000)
+    sessions = []
+    offset = 0
+    try:
+        while offset < len(payload):
+            id_length, idle, first_seq, summarized, summary_length, count = SESSION_HEADER.unpack_from(payload, offset)
+            offset += SESSION_HEADER.size
+            session_id = payload[offset:offset + id_length].decode("utf-8")
+            offset += id_length
+            summary = payload[offset:offset + summary_length].decode("utf-8")
+            offset += summary_length
+            records = []
+            for _ in range(count):
+                role, age_ms, length = MESSAGE_HEADER.unpack_from(payload, offset)
+                offset += MESSAGE_HEADER.size
+                content = payload[offset:offset + length]
+                offset += length
+                records.append(Record(ROLES[role].value, content.decode("utf-8"), now_ms - age_ms, length))
+            sessions.append((session_id, idle + elapsed, StoredSession(records, first_seq, summary, summarized)))
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Corrupted memory snapshot: {e}")
+    return sessions
+
+
+class MemorySnapshotter:
+    """
+    Periodic snapshots of the session memory, restored on startup.
+
+    Sessions are serialized in small batches on the event loop, which yields
+    between batches; compression and disk writes happen on a worker thread.
+    The file is replaced atomically once complete, so a crash mid-snapshot
+    leaves the previous one intact.
+    """
+
+    def __init__(self, memory_manager: MemoryManager, path: str, interval: float = 60.0, batch_size: int = 200):
+        """
+        Initialize a new snapshotter.
+
+        Args:
+            memory_manager: The memory to snapshot.
+            path: The snapshot file.
+            interval: Seconds between periodic snapshots. 0 only snapshots on shutdown.
+            batch_size: Sessions serialized between two yields to the event loop.
+        """
+        self.memory_manager = memory_manager
+        self.path = path
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.snapshots = 0
+        self.failures = 0
+        self.restored = 0
+        self.last_sessions = 0
+        self.last_bytes = 0
+        self.last_duration = 0.0
+
+    def restore(self) -> int:
+        """
+        Load the snapshot into the memory manager (called on startup).
+
+        Returns:
+            The number of restored sessions.
+        """
+        if not os.path.exists(self.path):
+            return 0
+        started = time.monotonic()
+        try:
+            with open(self.path, "rb") as snapshot_file:
+                sessions = decode_snapshot(snapshot_file.read())
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not restore memory snapshot {self.path}: {e}")
+            return 0
+        ttl = self.memory_manager.session_ttl
+        for session_id, idle, stored in sessions:
+            if ttl and idle >= ttl:
+                continue
+            self.memory_manager.restore(session_id, stored, idle)
+            self.restored += 1
+        logger.info(f"Restored {self.restored} sessions from {self.path} in {time.monotonic() - started:.2f}s")
+        return self.restored
+
+    async def snapshot(self) -> None:
+        """Write a snapshot of every session."""
+        async with self._lock:
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            temporary_path = f"{self.path}.tmp"
+            compressor = zlib.compressobj(level=6)
+            session_ids = list(self.memory_manager.memories)
+            written = 0
+            try:
+                snapshot_file = await loop.run_in_executor(None, open, temporary_path, "wb")
+                try:
+                    await loop.run_in_executor(None, snapshot_file.write, MAGIC + FILE_HEADER.pack(time.time()))
+                    for start in range(0, len(session_ids), self.batch_size):
+                        chunk = _encode_sessions(self.memory_manager, session_ids[start:start + self.batch_size])
+                        written += await loop.run_in_executor(None, self._write_chunk, snapshot_file, compressor, chunk)
+                    written += await loop.run_in_executor(None, self._finish, snapshot_file, compressor)
+                finally:
+                    snapshot_file.close()
+                os.replace(temporary_path, self.path)
+            except OSError as e:
+                self.failures += 1
+                logger.error(f"Memory snapshot to {self.path} failed: {e}")
+                return
+            self.snapshots += 1
+            self.last_sessions = len(session_ids)
+            self.last_bytes = written + len(MAGIC) + FILE_HEADER.size
+            self.last_duration = time.monotonic() - started
+            logger.info(f"Snapshot of {len(session_ids)} sessions written to {self.path} ({self.last_bytes} bytes, {self.last_duration:.2f}s)")
+
+    @staticmethod
+    def _write_chunk(snapshot_file: Any, compressor: Any, chunk: bytes) -> int:
+        compressed = compressor.compress(chunk)
+        snapshot_file.write(compressed)
+        return len(compressed)
+
+    @staticmethod
+    def _finish(snapshot_file: Any, compressor: Any) -> int:
+        compressed = compressor.flush()
+        snapshot_file.write(compressed)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+        return len(compressed)
+
+    def start(self) -> None:
+        """Start the periodic snapshots."""
+        if self.interval and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.snapshot()
+            except Exception as e:
+                logger.error(f"Memory snapshot failed: {e}")
+
+    async def stop(self) -> None:
+        """Stop the periodic snapshots and write a final one (called on shutdown)."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.snapshot()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "snapshots": self.snapshots,
+            "failures": self.failures,
+            "restored": self.restored,
+            "last_sessions": self.last_sessions,
+            "last_bytes": self.last_bytes,
+            "last_duration": self.last_duration
+        }
@@ -0,0 +1,57 @@
+from typing import List
+import re
+
+# End of sentence: punctuation, optional closing quote/bracket, then whitespace
+SENTENCE_END = re.compile(r"[.!?…]+[\"'»)\]]*\s+")
+
+
+class SentenceSplitter:
+    """Incrementally splits a token stream into complete sentences for speech synthesis."""
+
+    def __init__(self, min_chars: int = 20, max_chars: int = 300):
+        """
+        Initialize a new sentence splitter.
+
+        Args:
+            min_chars: Sentences shorter than this are merged with the next one,
+                so the TTS is not called for every "Oui." or "1.".
+            max_chars: Buffered text longer than this is cut at the last space,
+                so a run-on answer without punctuation still starts speaking.
+        """
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, token: str) -> List[str]:
+        """
+        Add a token to the buffer.
+
+        Args:
+            token: The next piece of LLM output.
+
+        Returns:
+            The sentences completed by this token, in order (often empty).
+        """
+        self._buffer += token
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            if match.end() - start >= self.min_chars:
+                sentences.append(self._buffer[start:match.end()].strip())
+                start = match.end()
+        self._buffer = self._buffer[start:]
+
+        if len(self._buffer) > self.max_chars:
+            cut = self._buffer.rfind(" ", 0, self.max_chars)
+            if cut <= 0:
+                cut = self.max_chars
+            sentences.append(self._buffer[:cut].strip())
+            self._buffer = self._buffer[cut:]
+
+        return [sentence for sentence in sentences if sentence]
+
+    def flush(self) -> List[str]:
+        """Return whatever is left in the buffer as a final sentence."""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return [remainder] if remainder else []
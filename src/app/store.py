@@ -0,0 +1,331 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from collections import Counter
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Longest wait in seconds before a failed batch is written again
+MAX_RETRY_DELAY = 5.0
+
+
+class Record(NamedTuple):
+    """One stored message."""
+    role: str
+    content: str
+    created_ms: int
+    size: int
+
+
+class StoredSession(NamedTuple):
+    """A session as loaded from a store. Positions count every message ever added, trimmed ones included."""
+    records: List[Record]
+    first_seq: int
+    summary: str
+    summarized: int
+
+
+class SessionStore:
+    """
+    Storage backend behind the MemoryManager.
+
+    The MemoryManager keeps the sessions it serves in process memory, which is
+    the read cache; the store is where they are persisted, so sessions outlive
+    a restart and can be picked up by another worker.
+    """
+
+    # Whether other processes may write the same sessions, so cached ones must be revalidated
+    shared = False
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        """Load a session, or None if it is not stored."""
+        return None
+
+    def version(self, session_id: str) -> Optional[int]:
+        """
+        Position after the last stored message of a session (0 if it is not stored),
+        or None if unknown, for instance while writes of the session are still buffered.
+        """
+        return None
+
+    def append(self, session_id: str, seq: int, record: Record, first_seq: int, summary: str, summarized: int) -> None:
+        """
+        Persist a new message.
+
+        Args:
+            session_id: The session identifier.
+            seq: Position of the message.
+            record: The message.
+            first_seq: Position of the oldest message still kept; older ones may be deleted.
+            summary: The session's rolling summary.
+            summarized: Position up to which messages are folded into the summary.
+        """
+
+    def delete(self, session_id: str) -> None:
+        """Delete a session."""
+
+    def flush(self) -> None:
+        """Write buffered changes now."""
+
+    def close(self) -> None:
+        """Flush and release resources (called on shutdown)."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory"}
+
+
+class InMemoryStore(SessionStore):
+    """Nothing is persisted: sessions only live in the MemoryManager, as before."""
+
+
+class SQLiteStore(SessionStore):
+    """
+    SQLite session store in WAL mode, shared by the workers of one host.
+
+    Writes go to a write-behind buffer flushed in batches, one transaction
+    each, by a background thread: the event loop never waits on the disk to
+    record a message. A batch that fails, e.g. because other workers keep
+    the database locked, is retried with backoff. Reads only happen when a
+    session is not cached by the MemoryManager, and WAL lets them run while
+    a batch is being written; writes still buffered are overlaid on what is
+    read.
+
+    Message positions are final only once written: if another worker stored
+    a message at the position a worker computed from its cached copy of the
+    session, the new message goes after it, and the stale copy is reloaded
+    when the MemoryManager revalidates it.
+    """
+
+    shared = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        next_seq INTEGER NOT NULL,
+        first_seq INTEGER NOT NULL,
+        summary TEXT NOT NULL DEFAULT '',
+        summarized INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        session_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_ms INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (session_id, seq)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.05, batch_size: int = 256, retention: float = 86400.0):
+        """
+        Initialize a new SQLite store.
+
+        Args:
+            path: Database file, shared by every worker.
+            flush_interval: Maximum time in seconds a write stays in the buffer.
+            batch_size: Buffered writes that trigger an immediate flush.
+            retention: Seconds of inactivity after which a stored session is deleted. 0 keeps sessions forever.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention = retention
+        self._write_connection = self._connect()
+        self._write_connection.executescript(self.SCHEMA)
+        self._read_connection = self._connect()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        # Write-behind buffer: ("append", session_id, args) or ("delete", session_id, None)
+        self._buffer: List[Tuple[str, str, Any]] = []
+        # The batch being written: still visible to load() until committed
+        self._writing: List[Tuple[str, str, Any]] = []
+        self._buffered_sessions: Counter = Counter()
+        self._buffer_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._writer: Optional[threading.Thread] = None
+        self._last_expiry = 0.0
+        # Backoff after a failed write: the next attempt is not made before _retry_at (monotonic)
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self.loads = 0
+        self.batches = 0
+        self.written = 0
+        self.write_errors = 0
+        self.conflicts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _ensure_writer(self) -> None:
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run_writer, name="session-store-writer", daemon=True)
+            self._writer.start()
+
+    def _run_writer(self) -> None:
+        while not self._closing:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if time.monotonic() >= self._retry_at:
+                self.flush()
+
+    def _enqueue(self, operation: Tuple[str, str, Any]) -> None:
+        with self._buffer_lock:
+            self._buffer.append(operation)
+            self._buffered_sessions[operation[1]] += 1
+            buffered = len(self._buffer)
+        self._ensure_writer()
+        if buffered >= self.batch_size:
+            self._wakeup.set()
+
+    def append(self, session_id: str, seq: int, record: Record, first_seq: int, summary: str, summarized: int) -> None:
+        self._enqueue(("append", session_id, (seq, record, first_seq, summary, summarized)))
+
+    def delete(self, session_id: str) -> None:
+        self._enqueue(("delete", session_id, None))
+
+    def flush(self) -> None:
+        with self._write_lock:
+            with self._buffer_lock:
+                batch, self._buffer = self._buffer, []
+                self._writing = batch
+            now = time.time()
+            if batch:
+                try:
+                    self._write(batch, now)
+                except sqlite3.Error as e:
+                    # E.g. SQLITE_BUSY when other workers hold the database: the batch goes back to the front
+                    # of the buffer and its sessions stay buffered, so nothing is lost or reloaded without it
+                    self.write_errors += 1
+                    self._retry_delay = min(max(self._retry_delay * 2, self.flush_interval, 0.01), MAX_RETRY_DELAY)
+                    self._retry_at = time.monotonic() + self._retry_delay
+                    logger.error(
+                        f"Session store write of {len(batch)} changes failed, retrying in {self._retry_delay:.2f}s: {e}")
+                    with self._buffer_lock:
+                        self._writing = []
+                        self._buffer = batch + self._buffer
+                    return
+                self.batches += 1
+                self.written += len(batch)
+                self._retry_delay = 0.0
+                # Sessions count as buffered until their batch is committed
+                with self._buffer_lock:
+                    self._writing = []
+                    self._buffered_sessions.subtract(operation[1] for operation in batch)
+                    self._buffered_sessions = +self._buffered_sessions
+            if self.retention and now - self._last_expiry >= 60:
+                self._last_expiry = now
+                self._expire(now - self.retention)
+
+    def _write(self, batch: List[Tuple[str, str, Any]], now: float) -> None:
+        connection = self._write_connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for kind, session_id, arguments in batch:
+                if kind == "delete":
+                    connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                    connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                    continue
+                seq, record, first_seq, summary, summarized = arguments
+                # The position is assigned here, in the transaction: another worker may have
+                # appended to the session since this one's cached copy was loaded
+                row = connection.execute("SELECT next_seq FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                if row is not None and row[0] > seq:
+                    self.conflicts += 1
+                    logger.info(f"Session {session_id} was extended by another worker, message {seq} stored at {row[0]}")
+                    seq = row[0]
+                connection.execute(
+                    "INSERT OR REPLACE INTO messages (session_id, seq, role, content, created_ms, size) VALUES (?, ?, ?, ?, ?, ?)",
+                    (session_id, seq, record.role, record.content, record.created_ms, record.size))
+                connection.execute(
+                    "INSERT INTO sessions (session_id, next_seq, first_seq, summary, summarized, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET next_seq = MAX(next_seq, excluded.next_seq), "
+                    "first_seq = excluded.first_seq, summary = excluded.summary, summarized = excluded.summarized, "
+                    "updated_at = excluded.updated_at",
+                    (session_id, seq + 1, first_seq, summary, summarized, now))
+                connection.execute("DELETE FROM messages WHERE session_id = ? AND seq < ?", (session_id, first_seq))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _expire(self, deadline: float) -> None:
+        try:
+            connection = self._write_connection
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)", (deadline,))
+            connection.execute("DELETE FROM sessions WHERE updated_at < ?", (deadline,))
+            connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning(f"Session store expiry failed: {e}")
+            if self._write_connection.in_transaction:
+                self._write_connection.execute("ROLLBACK")
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        # Read our own buffered writes without waiting for them to be flushed: they are replayed over
+        # the stored session. Replaying a change that was committed meanwhile is harmless.
+        with self._buffer_lock:
+            pending = [operation for operation in self._writing + self._buffer if operation[1] == session_id]
+        with self._read_lock:
+            row = self._read_connection.execute(
+                "SELECT first_seq, summary, summarized FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            messages: Dict[int, Record] = {}
+            if row is not None:
+                messages = {
+                    seq: Record(*values) for seq, *values in self._read_connection.execute(
+                        "SELECT seq, role, content, created_ms, size FROM messages WHERE session_id = ? AND seq >= ?",
+                        (session_id, row[0]))
+                }
+        self.loads += 1
+        state = list(row) if row is not None else None
+        for kind, _, arguments in pending:
+            if kind == "delete":
+                state, messages = None, {}
+                continue
+            seq, record, first_seq, summary, summarized = arguments
+            messages[seq] = record
+            state = [first_seq, summary, summarized]
+        if state is None:
+            return None
+        first_seq, summary, summarized = state
+        records = [messages[seq] for seq in sorted(messages) if seq >= first_seq]
+        return StoredSession(records, first_seq, summary, summarized)
+
+    def version(self, session_id: str) -> Optional[int]:
+        if self._buffered_sessions.get(session_id):
+            return None
+        with self._read_lock:
+            row = self._read_connection.execute(
+                "SELECT next_seq FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def close(self) -> None:
+        self._closing = True
+        self._wakeup.set()
+        if self._writer is not None:
+            self._writer.join(timeout=5.0)
+        self.flush()
+        if self._buffer:
+            logger.error(f"Session store closed with {len(self._buffer)} changes not written")
+        self._write_connection.close()
+        self._read_connection.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "buffered": len(self._buffer),
+            "batches": self.batches,
+            "written": self.written,
+            "write_errors": self.write_errors,
+            "conflicts": self.conflicts,
+            "loads": self.loads
+        }
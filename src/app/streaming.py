@@ -0,0 +1,102 @@
+from typing import AsyncGenerator, AsyncIterator, List, Optional
+import asyncio
+import time
+
+
+class FlushPolicy:
+    """Decides when buffered tokens are sent to the client as one frame."""
+
+    def __init__(self, interval: float = 0.05, max_bytes: int = 256, flush_first: bool = True):
+        """
+        Initialize a new flush policy.
+
+        Args:
+            interval: Maximum time in seconds a token may wait in the buffer. 0 disables batching.
+            max_bytes: Flush as soon as the buffer reaches this size (UTF-8 bytes).
+            flush_first: Send the first token immediately so time-to-first-token is unchanged.
+        """
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.flush_first = flush_first
+
+
+async def coalesce_tokens(stream: AsyncIterator[str], policy: Optional[FlushPolicy] = None) -> AsyncGenerator[str, None]:
+    """
+    Batch a token stream into larger frames according to a flush policy.
+
+    The buffer is flushed when it is older than `policy.interval`, when it
+    reaches `policy.max_bytes`, or when the stream ends. The time limit is
+    honoured even if the upstream stalls between two tokens.
+
+    Args:
+        stream: The token stream, e.g. from Model.stream_text_response.
+        policy: The flush policy. Defaults to FlushPolicy().
+
+    Yields:
+        Concatenated tokens, one string per frame.
+    """
+    policy = policy or FlushPolicy()
+    iterator = stream.__aiter__()
+
+    if policy.interval <= 0:
+        try:
+            async for token in iterator:
+                yield token
+        finally:
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+        return
+
+    buffer: List[str] = []
+    buffer_bytes = 0
+    buffer_started = 0.0
+    first = policy.flush_first
+    next_token: Optional[asyncio.Task] = None
+    try:
+        while True:
+            if next_token is None:
+                next_token = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None
+            if buffer:
+                timeout = max(0.0, buffer_started + policy.interval - time.monotonic())
+            done, _ = await asyncio.wait({next_token}, timeout=timeout)
+
+            if not done:
+                # Upstream is slow: do not hold what we already have
+                yield "".join(buffer)
+                buffer, buffer_bytes = [], 0
+                continue
+
+            task, next_token = next_token, None
+            try:
+                token = task.result()
+            except StopAsyncIteration:
+                break
+            if not token:
+                continue
+
+            if first:
+                first = False
+                yield token
+                continue
+
+            if not buffer:
+                buffer_started = time.monotonic()
+            buffer.append(token)
+            buffer_bytes += len(token.encode("utf-8"))
+            if buffer_bytes >= policy.max_bytes or time.monotonic() - buffer_started >= policy.interval:
+                yield "".join(buffer)
+                buffer, buffer_bytes = [], 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if next_token is not None and not next_token.done():
+            next_token.cancel()
+            try:
+                await next_token
+            except (asyncio.CancelledError, Exception):
+                pass
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
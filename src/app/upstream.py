@@ -0,0 +1,140 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+import logging
+import time
+
+from groq import APIConnectionError, AsyncGroq, Groq
+
+logger = logging.getLogger(__name__)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True for errors another key or model may not have: rate limits, server errors, connection issues."""
+    if isinstance(error, APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code == 429 or (status_code is not None and status_code >= 500)
+
+
+class Upstream:
+    """One Groq account (API key) with its clients and health state."""
+
+    def __init__(self, name: str, api_key: str):
+        """
+        Initialize a new upstream.
+
+        Args:
+            name: A label for logs and stats. The API key itself is never logged.
+            api_key: The Groq API key.
+        """
+        self.name = name
+        try:
+            self.client = Groq(api_key=api_key)
+            self.async_client = AsyncGroq(api_key=api_key)
+        except TypeError as e:
+            logging.error(f"Error initializing Groq clients: {e}")
+            # Fallback to basic initialization if the API changed
+            from httpx import AsyncClient, Client
+            logger.info("Using fallback initialization with httpx clients")
+            self.client = Groq(api_key=api_key, http_client=Client())
+            self.async_client = AsyncGroq(api_key=api_key, http_client=AsyncClient())
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+
+class UpstreamPool:
+    """
+    A pool of Groq accounts and models with least-loaded routing and failover.
+
+    Candidates are ordered by model preference first (the requested model,
+    then the overflow models), and by load within a model. Accounts that
+    recently failed with a 429 or 5xx cool down and are tried last.
+    """
+
+    def __init__(self, upstreams: List[Upstream], fallback_models: Optional[List[str]] = None, rate_limit_cooldown: float = 30.0, error_cooldown: float = 5.0):
+        """
+        Initialize a new upstream pool.
+
+        Args:
+            upstreams: The configured accounts.
+            fallback_models: Chat models to overflow to, in order, when the requested model fails everywhere.
+            rate_limit_cooldown: Seconds an account is avoided after a 429.
+            error_cooldown: Seconds an account is avoided after a 5xx or connection error.
+        """
+        self.upstreams = upstreams
+        self.fallback_models = fallback_models or []
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.error_cooldown = error_cooldown
+        self.failovers = 0
+
+    @classmethod
+    def from_keys(cls, api_keys: List[str], **kwargs) -> "UpstreamPool":
+        upstreams = [Upstream(f"key{index + 1}", api_key) for index, api_key in enumerate(api_keys)]
+        return cls(upstreams, **kwargs)
+
+    def __bool__(self) -> bool:
+        return bool(self.upstreams)
+
+    @property
+    def primary(self) -> Optional[Upstream]:
+        return self.upstreams[0] if self.upstreams else None
+
+    def candidates(self, model: str, overflow: bool = True) -> List[Tuple[Upstream, str]]:
+        """
+        The (upstream, model) pairs to try, in order.
+
+        Args:
+            model: The requested model.
+            overflow: Whether to append the fallback models after the requested one.
+        """
+        models = [model]
+        if overflow:
+            models += [fallback for fallback in self.fallback_models if fallback != model]
+        by_load = sorted(self.upstreams, key=lambda upstream: (not upstream.healthy, upstream.in_flight))
+        return [(upstream, candidate_model) for candidate_model in models for upstream in by_load]
+
+    @contextmanager
+    def track(self, upstream: Upstream) -> Iterator[None]:
+        """Count a request as in flight on an upstream for the duration of the block."""
+        upstream.in_flight += 1
+        try:
+            yield
+        finally:
+            upstream.in_flight -= 1
+
+    def mark_success(self, upstream: Upstream) -> None:
+        upstream.successes += 1
+        upstream.cooldown_until = 0.0
+
+    def mark_failure(self, upstream: Upstream, error: BaseException) -> None:
+        upstream.failures += 1
+        if getattr(error, "status_code", None) == 429:
+            cooldown = self.rate_limit_cooldown
+        elif is_retryable(error):
+            cooldown = self.error_cooldown
+        else:
+            return
+        upstream.cooldown_until = time.monotonic() + cooldown
+        logger.warning(f"Upstream {upstream.name} cooling down for {cooldown:.0f}s after: {error}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "failovers": self.failovers,
+            "fallback_models": self.fallback_models,
+            "upstreams": [
+                {
+                    "name": upstream.name,
+                    "healthy": upstream.healthy,
+                    "in_flight": upstream.in_flight,
+                    "successes": upstream.successes,
+                    "failures": upstream.failures
+                }
+                for upstream in self.upstreams
+            ]
+        }
@@ -1,25 +1,156 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import os
 import json
+import logging
 import mimetypes
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:  # optional: faster parser, the standard json module is used without it
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_PARSER = "orjson" if orjson is not None else "json"
+# Parsed documents kept by load_json, least recently used evicted first
+JSON_CACHE_SIZE = 4096
+DEFAULT_LOADER_WORKERS = 8
+
+_json_cache: "OrderedDict[str, Tuple[int, int, Any]]" = OrderedDict()
+_json_cache_lock = threading.Lock()
+_json_cache_hits = 0
+_json_cache_misses = 0
 
 
 def get_file_list(directory_path: str) -> list[str]:
     return os.listdir(directory_path)
 
 
+def parse_json(data: bytes) -> Any:
+    """
+    Parse a JSON document with orjson when installed, the json module otherwise.
+
+    Raises:
+        ValueError: If the document is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_json(json_file: str, cache: bool = True) -> Any:
+    """
+    Read and parse a JSON file.
+
+    With cache, parsed documents are kept keyed by path, modification time
+    and size, so an unchanged file is never parsed twice. Cached documents
+    are shared: callers must not modify them.
+
+    Raises:
+        OSError: If the file cannot be read.
+        ValueError: If it is not valid JSON.
+    """
+    global _json_cache_hits, _json_cache_misses
+    status = os.stat(json_file)
+    if cache:
+        with _json_cache_lock:
+            cached = _json_cache.get(json_file)
+            if cached is not None and cached[:2] == (status.st_mtime_ns, status.st_size):
+                _json_cache.move_to_end(json_file)
+                _json_cache_hits += 1
+                return cached[2]
+            _json_cache_misses += 1
+    with open(json_file, "rb") as f:
+        document = parse_json(f.read())
+    if cache:
+        with _json_cache_lock:
+            _json_cache[json_file] = (status.st_mtime_ns, status.st_size, document)
+            _json_cache.move_to_end(json_file)
+            while len(_json_cache) > JSON_CACHE_SIZE:
+                _json_cache.popitem(last=False)
+    return document
+
+
 def get_json_content(json_file: str) -> dict:
-    with open(json_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data
+    return load_json(json_file)
+
+
+def _load_json_batch(directory_path: str, names: List[str], cache: bool) -> List[Tuple[str, Any, Optional[Exception]]]:
+    results = []
+    for name in names:
+        try:
+            results.append((name, load_json(os.path.join(directory_path, name), cache), None))
+        except (OSError, ValueError) as e:
+            results.append((name, None, e))
+    return results
+
+
+def iter_json_content(
+    directory_path: str,
+    suffix: str = ".json",
+    workers: int = DEFAULT_LOADER_WORKERS,
+    cache: bool = True,
+    errors: Optional[List[Tuple[str, Exception]]] = None,
+    batch_size: int = 16,
+    names: Optional[List[str]] = None
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Stream the JSON documents of a directory as (file name, document), in file name order.
+
+    Files are read and parsed on a thread pool, batch_size files per task and
+    at most 2 * workers tasks ahead of the consumer, so a large corpus never
+    sits fully in memory (pass cache=False for that, the cache keeps what it
+    parses). A file that cannot be read or parsed is logged and skipped, and
+    added to errors if given. names restricts the loading to these files.
+    """
+    if names is None:
+        names = get_file_list(directory_path)
+    names = sorted(name for name in names if name.endswith(suffix))
+    batches = iter([names[start:start + batch_size] for start in range(0, len(names), batch_size)])
+    workers = max(1, workers)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="json-loader")
+    pending: deque = deque()
+
+    def submit_next() -> None:
+        batch = next(batches, None)
+        if batch is not None:
+            pending.append(executor.submit(_load_json_batch, directory_path, batch, cache))
+
+    try:
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            future = pending.popleft()
+            submit_next()
+            for name, document, error in future.result():
+                if error is not None:
+                    logger.error(f"Skipping JSON file {name}: {error}")
+                    if errors is not None:
+                        errors.append((name, error))
+                    continue
+                yield name, document
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_all_json_content(directory_path: str, suffix: str = ".json", workers: int = DEFAULT_LOADER_WORKERS) -> list[dict]:
+    """
+    Charge tous les documents JSON d'un répertoire, en parallèle et avec cache.
+    Les fichiers illisibles sont ignorés.
+    """
+    return [document for _, document in iter_json_content(directory_path, suffix, workers)]
 
 
-def get_all_json_content(directory_path: str) -> list[dict]:
-    jsons_paths = get_file_list(directory_path)
-    content = []
-    for json_file in jsons_paths:
-        full_path = os.path.join(directory_path, json_file)
-        content.append(get_json_content(full_path))
-    return content
+def json_cache_stats() -> Dict[str, Any]:
+    return {
+        "parser": JSON_PARSER,
+        "entries": len(_json_cache),
+        "hits": _json_cache_hits,
+        "misses": _json_cache_misses
+    }
 
 
 def is_wav_file(filename: str = None, mime_type: str = None) -> bool:
@@ -61,3 +192,39 @@ def is_wav_bytes(audio_bytes: bytes) -> bool:
         audio_bytes[0:4] == b'RIFF'
         and audio_bytes[8:12] == b'WAVE'
     )
+
+
+def get_env_int(name: str, default: int) -> int:
+    """
+    Lit une variable d'environnement entière, avec une valeur par défaut.
+    """
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def get_env_float(name: str, default: float) -> float:
+    """
+    Lit une variable d'environnement décimale, avec une valeur par défaut.
+    """
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def get_env_bool(name: str, default: bool) -> bool:
+    """
+    Lit une variable d'environnement booléenne ("1", "true", "yes", "on").
+    """
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
@@ -0,0 +1,289 @@
+from typing import List, Optional, Sequence, Tuple
+from collections import Counter
+import json
+import logging
+import math
+import os
+import time
+import zlib
+
+from app.retrieval import Passage, tokenize
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional: without it only BM25 retrieval is available
+    np = None
+
+logger = logging.getLogger(__name__)
+
+HASHING_EMBEDDING = "hashing-v1"
+FASTEMBED_EMBEDDING = "fastembed"
+SENTENCE_TRANSFORMERS_EMBEDDING = "sentence-transformers"
+# Multilingual paraphrase model, small enough for the CPU; available in both libraries
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+DEFAULT_DIMENSIONS = 512
+# Rows scored per matrix product, to bound the temporary score matrix
+SEARCH_BATCH_ROWS = 65536
+
+
+def _features(text: str) -> Counter:
+    """Words and word bigrams of a text."""
+    terms = tokenize(text)
+    features = Counter(terms)
+    features.update(f"{first} {second}" for first, second in zip(terms, terms[1:]))
+    return features
+
+
+def _normalize_rows(matrix: "np.ndarray") -> "np.ndarray":
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def embed(texts: Sequence[str], dimensions: int = DEFAULT_DIMENSIONS) -> "np.ndarray":
+    """
+    Embed texts on the CPU with the hashing trick.
+
+    Each word and bigram is hashed to a dimension with a hashed sign, weighted
+    by 1 + log(tf), and rows are L2-normalized so dot products are cosines.
+    Deterministic across processes (crc32, not Python's salted hash).
+
+    Returns:
+        A float32 matrix of shape (len(texts), dimensions).
+    """
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, count in _features(text).items():
+            hashed = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if hashed & 0x80000000 else -1.0
+            matrix[row, hashed % dimensions] += sign * (1.0 + math.log(count))
+    return _normalize_rows(matrix)
+
+
+class Embedder:
+    """
+    Turns passages and queries into L2-normalized float32 vectors.
+
+    The name and model are stored with the index, so queries are embedded
+    the same way as the passages were.
+    """
+
+    name = ""
+
+    def __init__(self, model: str = ""):
+        self.model = model
+
+    def embed_passages(self, texts: Sequence[str]) -> "np.ndarray":
+        raise NotImplementedError
+
+    def embed_queries(self, texts: Sequence[str]) -> "np.ndarray":
+        return self.embed_passages(texts)
+
+
+class HashingEmbedder(Embedder):
+    """Lexical embedding by hashing words and bigrams: no model, but no synonyms or paraphrases either."""
+
+    name = HASHING_EMBEDDING
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        super().__init__(str(dimensions))
+        self.dimensions = dimensions
+
+    def embed_passages(self, texts: Sequence[str]) -> "np.ndarray":
+        return embed(texts, self.dimensions)
+
+
+class FastEmbedEmbedder(Embedder):
+    """Semantic embedding with a local ONNX model run by fastembed."""
+
+    name = FASTEMBED_EMBEDDING
+
+    def __init__(self, model: str = DEFAULT_EMBEDDING_MODEL):
+        from fastembed import TextEmbedding
+        super().__init__(model)
+        self._model = TextEmbedding(model_name=model)
+
+    def embed_passages(self, texts: Sequence[str]) -> "np.ndarray":
+        return _normalize_rows(list(self._model.passage_embed(list(texts))))
+
+    def embed_queries(self, texts: Sequence[str]) -> "np.ndarray":
+        return _normalize_rows(list(self._model.query_embed(list(texts))))
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """Semantic embedding with a local sentence-transformers model on the CPU."""
+
+    name = SENTENCE_TRANSFORMERS_EMBEDDING
+
+    def __init__(self, model: str = DEFAULT_EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+        super().__init__(model)
+        self._model = SentenceTransformer(model, device="cpu")
+
+    def embed_passages(self, texts: Sequence[str]) -> "np.ndarray":
+        return _normalize_rows(self._model.encode(list(texts), convert_to_numpy=True))
+
+
+def create_embedder(name: str = "auto", model: str = "") -> Embedder:
+    """
+    Create an embedder.
+
+    Args:
+        name: HASHING_EMBEDDING, FASTEMBED_EMBEDDING, SENTENCE_TRANSFORMERS_EMBEDDING, or "auto"
+            for the first semantic library installed, falling back to hashing.
+        model: The model of a semantic embedder (default DEFAULT_EMBEDDING_MODEL),
+            or the dimensions of the hashing embedder.
+
+    Raises:
+        ImportError: If the library of the requested embedder is not installed.
+        ValueError: If the name is unknown.
+    """
+    if np is None:
+        raise ImportError("numpy is required for embeddings")
+    if name == "auto":
+        for candidate in (FASTEMBED_EMBEDDING, SENTENCE_TRANSFORMERS_EMBEDDING):
+            try:
+                return create_embedder(candidate, model)
+            except ImportError:
+                continue
+        logger.info("No local embedding model library installed (fastembed, sentence-transformers), using hashing")
+        return create_embedder(HASHING_EMBEDDING, "")
+    if name == HASHING_EMBEDDING:
+        return HashingEmbedder(int(model) if model else DEFAULT_DIMENSIONS)
+    if name == FASTEMBED_EMBEDDING:
+        return FastEmbedEmbedder(model or DEFAULT_EMBEDDING_MODEL)
+    if name == SENTENCE_TRANSFORMERS_EMBEDDING:
+        return SentenceTransformerEmbedder(model or DEFAULT_EMBEDDING_MODEL)
+    raise ValueError(f"Unknown embedding {name}")
+
+
+def build_vector_index(passages: List[Passage], prefix: str, embedder: Optional[Embedder] = None, batch_size: int = 256) -> None:
+    """
+    Offline build: write the passage embeddings to `<prefix>.npy` and the passages to `<prefix>.json`.
+
+    Args:
+        passages: The passages to embed, in index order.
+        prefix: Path of the index files, without extension.
+        embedder: How passages are embedded. Defaults to create_embedder("auto").
+        batch_size: Passages embedded at a time.
+    """
+    if np is None:
+        raise RuntimeError("numpy is required to build the vector index")
+    embedder = embedder or create_embedder()
+    matrix = None
+    dimensions = 0
+    for start in range(0, len(passages), batch_size):
+        batch = passages[start:start + batch_size]
+        vectors = embedder.embed_passages([f"{passage.source} {passage.text}" for passage in batch])
+        if matrix is None:
+            # The model decides the dimensions: known once the first batch is embedded
+            dimensions = vectors.shape[1]
+            matrix = np.lib.format.open_memmap(
+                f"{prefix}.npy.tmp", mode="w+", dtype=np.float32, shape=(len(passages), dimensions))
+        matrix[start:start + len(batch)] = vectors
+    if matrix is None:
+        np.save(f"{prefix}.npy.tmp", np.zeros((0, 0), dtype=np.float32))
+        # np.save appends .npy to names without it
+        os.replace(f"{prefix}.npy.tmp.npy", f"{prefix}.npy.tmp")
+    else:
+        matrix.flush()
+        del matrix
+    with open(f"{prefix}.json.tmp", "w", encoding="utf-8") as metadata_file:
+        json.dump({
+            "embedding": embedder.name,
+            "model": embedder.model,
+            "dimensions": dimensions,
+            "passages": [[passage.source, passage.text] for passage in passages]
+        }, metadata_file, ensure_ascii=False)
+    os.replace(f"{prefix}.npy.tmp", f"{prefix}.npy")
+    os.replace(f"{prefix}.json.tmp", f"{prefix}.json")
+
+
+class VectorIndex:
+    """
+    Dense retrieval over a memory-mapped embedding matrix.
+
+    The matrix is opened with mmap, so startup does not read it and every
+    worker of the host shares the same page-cache copy. Queries are embedded
+    with the embedder the index was built with.
+    """
+
+    def __init__(self, prefix: str):
+        """
+        Open an index written by build_vector_index.
+
+        Args:
+            prefix: Path of the index files, without extension.
+
+        Raises:
+            RuntimeError: If numpy is not installed.
+            ImportError: If the library of the index's embedder is not installed.
+            OSError, ValueError: If the files are missing or inconsistent.
+        """
+        if np is None:
+            raise RuntimeError("numpy is required for the vector index")
+        with open(f"{prefix}.json", "r", encoding="utf-8") as metadata_file:
+            metadata = json.load(metadata_file)
+        name = metadata.get("embedding", "")
+        model = metadata.get("model") or (str(metadata.get("dimensions", "")) if name == HASHING_EMBEDDING else "")
+        self.embedder = create_embedder(name, model)
+        self.dimensions: int = metadata["dimensions"]
+        self.passages = [Passage(source, text) for source, text in metadata["passages"]]
+        self.matrix = np.load(f"{prefix}.npy", mmap_mode="r")
+        if self.matrix.shape != (len(self.passages), self.dimensions):
+            raise ValueError(f"Vector index {prefix} does not match its passages")
+
+    def search_batch(self, queries: Sequence[str], k: int = 3) -> List[List[Tuple[Passage, float]]]:
+        """
+        Find the k passages closest to each query.
+
+        The matrix is scanned once for all queries, one block of rows at a
+        time: each block costs a single matrix product.
+
+        Returns:
+            For each query, up to k (passage, cosine similarity) pairs, best first.
+        """
+        if not queries or not len(self.passages):
+            return [[] for _ in queries]
+        query_matrix = self.embedder.embed_queries(queries)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self.passages), SEARCH_BATCH_ROWS):
+            block = np.asarray(self.matrix[start:start + SEARCH_BATCH_ROWS])
+            scores = np.concatenate([best_scores, query_matrix @ block.T], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(
+                np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+            keep = min(k, scores.shape[1])
+            top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+
+        results = []
+        for scores, rows in zip(best_scores, best_rows):
+            order = np.argsort(-scores)
+            results.append([(self.passages[rows[i]], float(scores[i])) for i in order if scores[i] > 0])
+        return results
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[Passage, float]]:
+        """The k passages closest to a query, best first."""
+        return self.search_batch([query], k)[0]
+
+
+def open_vector_index(prefix: str) -> Optional[VectorIndex]:
+    """Open the vector index if it exists and numpy is available, otherwise None."""
+    if not prefix or not os.path.exists(f"{prefix}.npy"):
+        return None
+    if np is None:
+        logger.warning(f"Vector index {prefix} found but numpy is not installed, using BM25 only")
+        return None
+    started = time.monotonic()
+    try:
+        index = VectorIndex(prefix)
+    except (OSError, ValueError, KeyError, ImportError) as e:
+        logger.error(f"Could not open vector index {prefix}: {e}")
+        return None
+    logger.info(
+        f"Opened vector index {prefix} ({len(index.passages)} passages, {index.embedder.name} {index.embedder.model}) "
+        f"in {time.monotonic() - started:.2f}s")
+    return index
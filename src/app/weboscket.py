@@ -1,12 +1,41 @@
-from typing import AsyncGenerator, Optional
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+from collections import Counter, deque
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
 import json
 import asyncio
-import socket
 import os
-import requests
-from groq import AsyncGroq, Groq
+import time
+import uuid
+from groq import APIConnectionError
 import logging
+from app.admission import AdmissionController, AdmissionTimeout, QueueCallback, estimate_tokens
+from app.cache import ResponseCache, make_cache_key
+from app.circuit import CircuitBreaker, CircuitOpenError
+from app.connectivity import ConnectivityMonitor
+from app.context import SUMMARY_HEADING, ContextManager
+from app.hedging import HedgePolicy
 from app.memory import MemoryManager
+from app.packing import ContextPacker
+from app.prompt import PROMPT_SUMMARY, PROMPT_VERSION, prefix_hash, static_prefix
+from app.resume import EXPIRED, ResumeTokens
+from app.retrieval import KnowledgeBase, format_passages
+from app.singleflight import StreamCoalescer, make_flight_key
+from app.snapshot import MemorySnapshotter
+from app.speech import SentenceSplitter
+from app.store import InMemoryStore, SQLiteStore
+from app.streaming import FlushPolicy
+from app.upstream import Upstream, UpstreamPool, is_retryable
+from app.utils import get_env_bool, get_env_float, get_env_int
+from app.vectors import open_vector_index
+
+T = TypeVar("T")
+
+DEFAULT_CHAT_MODEL = "llama3-70b-8192"
+DEFAULT_SUMMARY_MODEL = "llama3-8b-8192"
+
+OFFLINE_MESSAGE = "Je ne suis pas en mesure de répondre en mode hors ligne pour le moment."
+BUSY_MESSAGE = "Le service est très sollicité en ce moment, réessaie dans quelques instants."
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -18,217 +47,823 @@ class Model:
     def __init__(self):
         print("Initializing Model...")
         self.groq_api_key = os.getenv("GROQ_API_KEY")
-        print(f"API Key present: {bool(self.groq_api_key)}")
-        # Initialize clients without any optional parameters
-        if self.groq_api_key:
-            try:
-                logger.info("Initializing Groq clients with API key")
-                self.groq_client = Groq(api_key=self.groq_api_key)
-                self.groq_async_client = AsyncGroq(api_key=self.groq_api_key)
-            except TypeError as e:
-                logging.error(f"Error initializing Groq clients: {e}")
-                # Fallback to basic initialization if the API changed
-                from httpx import AsyncClient, Client
-                logger.info("Using fallback initialization with httpx clients")
-                self.groq_client = Groq(api_key=self.groq_api_key, http_client=Client())
-                self.groq_async_client = AsyncGroq(api_key=self.groq_api_key, http_client=AsyncClient())
+        # Extra keys spread the load over several accounts: GROQ_API_KEYS=key1,key2
+        api_keys = [key.strip() for key in os.getenv("GROQ_API_KEYS", "").split(",") if key.strip()]
+        if self.groq_api_key and self.groq_api_key not in api_keys:
+            api_keys.insert(0, self.groq_api_key)
+        print(f"API Key present: {bool(api_keys)}")
+        self.chat_model = os.getenv("GROQ_CHAT_MODEL", DEFAULT_CHAT_MODEL)
+        fallback_models = [name.strip() for name in os.getenv("GROQ_FALLBACK_MODELS", "llama3-8b-8192").split(",") if name.strip()]
+        if api_keys:
+            logger.info(f"Initializing Groq clients with {len(api_keys)} API key(s)")
         else:
             logging.error("GROQ_API_KEY environment variable is not set")
-            self.groq_client = None
-            self.groq_async_client = None
+        self.upstream_pool = UpstreamPool.from_keys(
+            api_keys,
+            fallback_models=fallback_models,
+            rate_limit_cooldown=get_env_float("GROQ_RATE_LIMIT_COOLDOWN", 30.0),
+            error_cooldown=get_env_float("GROQ_ERROR_COOLDOWN", 5.0)
+        )
+        # Clients of the first key, kept for the checks below and for backward compatibility
+        primary = self.upstream_pool.primary
+        self.groq_client = primary.client if primary else None
+        self.groq_async_client = primary.async_client if primary else None
             
-        self.memory_manager = MemoryManager()
+        self.memory_manager = MemoryManager(
+            session_ttl=get_env_float("MEMORY_SESSION_TTL", 3600.0),
+            max_sessions=get_env_int("MEMORY_MAX_SESSIONS", 10000),
+            max_total_bytes=get_env_int("MEMORY_MAX_BYTES", 256 * 1024 * 1024),
+            session_max_messages=get_env_int("MEMORY_SESSION_MAX_MESSAGES", 50),
+            session_max_bytes=get_env_int("MEMORY_SESSION_MAX_BYTES", 64 * 1024),
+            columnar=get_env_bool("MEMORY_COLUMNAR", False),
+            store=self._create_session_store(),
+            revalidate_after=get_env_float("SESSION_STORE_REVALIDATE_SECONDS", 2.0)
+        )
+        # History sent to the LLM: recent turns verbatim, older ones as a rolling summary
+        self.summary_model = os.getenv("CONTEXT_SUMMARY_MODEL", DEFAULT_SUMMARY_MODEL)
+        self.context = ContextManager(
+            self.memory_manager,
+            token_budget=get_env_int("CONTEXT_TOKEN_BUDGET", 1500),
+            keep_turns=get_env_int("CONTEXT_KEEP_TURNS", 6),
+            summarizer=self.summarize_history
+        )
+        # Knowledge documents retrieved into the {rag_document} slot of the course and evaluation prompts
+        self.knowledge = KnowledgeBase(
+            os.getenv("KNOWLEDGE_DIR", "knowledge"),
+            top_k=get_env_int("RAG_TOP_K", 3),
+            chunk_words=get_env_int("RAG_CHUNK_WORDS", 120),
+            chunk_overlap=get_env_int("RAG_CHUNK_OVERLAP", 30),
+            reload_interval=get_env_float("KNOWLEDGE_RELOAD_INTERVAL", 5.0)
+        )
+        # Retrieved passages are packed into a token budget; 0 sends the RAG_TOP_K passages as they are
+        rag_token_budget = get_env_int("RAG_TOKEN_BUDGET", 600)
+        self.rag_candidates = get_env_int("RAG_CANDIDATES", 8)
+        self.packer = ContextPacker(
+            token_budget=rag_token_budget,
+            duplicate_threshold=get_env_float("RAG_DUPLICATE_THRESHOLD", 0.6)
+        ) if rag_token_budget > 0 else None
+        # Warm restarts: the session memory is snapshotted to disk and restored on startup
+        snapshot_path = os.getenv("MEMORY_SNAPSHOT_PATH", "")
+        self.snapshotter = MemorySnapshotter(
+            self.memory_manager,
+            snapshot_path,
+            interval=get_env_float("MEMORY_SNAPSHOT_INTERVAL", 60.0)
+        ) if snapshot_path else None
+        # Signed tokens letting reconnecting clients reattach to their session
+        self.resume_tokens = ResumeTokens(
+            secret=os.getenv("SESSION_RESUME_SECRET"),
+            max_age=get_env_float("SESSION_RESUME_MAX_AGE", 86400.0)
+        )
+        # "messages": static system prefix then the history as user/assistant turns (prefix-cache friendly);
+        # "flat": the history inside the system prompt, as before
+        self.prompt_assembly = os.getenv("PROMPT_ASSEMBLY", "messages").lower()
+        self.prefix_requests: Counter = Counter()
+        # Per-call timeouts for the voice pipeline, and a bounded pool for the sync client fallback
+        self.stt_timeout = get_env_float("GROQ_STT_TIMEOUT", 20.0)
+        self.tts_timeout = get_env_float("GROQ_TTS_TIMEOUT", 30.0)
+        self.tts_concurrency = get_env_int("VOICE_TTS_CONCURRENCY", 3)
+        self.response_cache = ResponseCache(
+            max_entries=get_env_int("RESPONSE_CACHE_SIZE", 1024),
+            ttl=get_env_float("RESPONSE_CACHE_TTL", 600.0)
+        )
+        self.single_flight_enabled = get_env_bool("SINGLE_FLIGHT_ENABLED", True)
+        self.single_flight = StreamCoalescer()
+        # Admission control shared by every Groq call (chat, transcription, speech)
+        self.admission = AdmissionController(
+            requests_per_minute=get_env_int("GROQ_REQUESTS_PER_MINUTE", 0),
+            tokens_per_minute=get_env_int("GROQ_TOKENS_PER_MINUTE", 0),
+            max_wait=get_env_float("GROQ_ADMISSION_MAX_WAIT", 30.0),
+            max_queue=get_env_int("GROQ_ADMISSION_MAX_QUEUE", 1000)
+        )
+        self.expected_completion_tokens = get_env_int("GROQ_EXPECTED_COMPLETION_TOKENS", 256)
+        # One circuit breaker per upstream endpoint
+        self.breakers = {
+            endpoint: CircuitBreaker(
+                endpoint,
+                window=get_env_int("CIRCUIT_WINDOW", 20),
+                min_calls=get_env_int("CIRCUIT_MIN_CALLS", 5),
+                error_rate_threshold=get_env_float("CIRCUIT_ERROR_RATE", 0.5),
+                slow_call_threshold=get_env_float("CIRCUIT_SLOW_CALL_SECONDS", 10.0),
+                slow_rate_threshold=get_env_float("CIRCUIT_SLOW_RATE", 0.8),
+                open_duration=get_env_float("CIRCUIT_OPEN_SECONDS", 30.0)
+            )
+            for endpoint in ("chat", "stt", "tts", "summary")
+        }
+        # Optional hedging of chat completions with a slow first token
+        self.hedging = HedgePolicy(
+            enabled=get_env_bool("HEDGE_ENABLED", False),
+            percentile=get_env_float("HEDGE_PERCENTILE", 95.0),
+            min_delay=get_env_float("HEDGE_MIN_DELAY", 0.2),
+            max_delay=get_env_float("HEDGE_MAX_DELAY", 3.0)
+        )
+        # How streamed tokens are batched into websocket frames
+        self.flush_policy = FlushPolicy(
+            interval=get_env_float("STREAM_FLUSH_INTERVAL_MS", 50.0) / 1000,
+            max_bytes=get_env_int("STREAM_FLUSH_BYTES", 256)
+        )
+        self.blocking_executor = ThreadPoolExecutor(
+            max_workers=get_env_int("GROQ_BLOCKING_WORKERS", 4), thread_name_prefix="groq-blocking")
+        self.connectivity = ConnectivityMonitor(
+            interval=get_env_float("CONNECTIVITY_PROBE_INTERVAL", 30.0),
+            offline_interval=get_env_float("CONNECTIVITY_OFFLINE_PROBE_INTERVAL", 5.0),
+            probe_timeout=get_env_float("CONNECTIVITY_PROBE_TIMEOUT", 1.5),
+            failure_threshold=get_env_int("CONNECTIVITY_FAILURE_THRESHOLD", 2),
+            success_threshold=get_env_int("CONNECTIVITY_SUCCESS_THRESHOLD", 1)
+        )
+
+    @staticmethod
+    def _create_session_store():
+        """The session store selected by SESSION_STORE ("memory" or "sqlite")."""
+        backend = os.getenv("SESSION_STORE", "memory").lower()
+        if backend == "sqlite":
+            path = os.getenv("SESSION_STORE_PATH", "sessions.db")
+            logger.info(f"Persisting sessions to SQLite database {path}")
+            return SQLiteStore(
+                path,
+                flush_interval=get_env_float("SESSION_STORE_FLUSH_MS", 50.0) / 1000,
+                batch_size=get_env_int("SESSION_STORE_BATCH_SIZE", 256),
+                retention=get_env_float("SESSION_STORE_RETENTION", 86400.0)
+            )
+        if backend != "memory":
+            logger.error(f"Unknown SESSION_STORE {backend}, sessions are kept in memory only")
+        return InMemoryStore()
+
+    async def start(self) -> None:
+        """Start the background tasks owned by the model (called on app startup)."""
+        if self.snapshotter is not None:
+            self.snapshotter.restore()
+            self.snapshotter.start()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.knowledge.load)
+        # Opening the index may load an embedding model
+        self.knowledge.vectors = await loop.run_in_executor(
+            None, open_vector_index, os.getenv("RAG_VECTOR_INDEX", "knowledge_vectors"))
+        self.knowledge.start()
+        self.connectivity.start()
+
+    async def stop(self) -> None:
+        """Stop the background tasks owned by the model (called on app shutdown)."""
+        await self.connectivity.stop()
+        await self.context.stop()
+        await self.knowledge.stop()
+        if self.snapshotter is not None:
+            await self.snapshotter.stop()
+        self.memory_manager.close()
+        self.blocking_executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Runtime statistics of the model's components, for monitoring."""
+        return {
+            "online": self.is_online(),
+            "memory": self.memory_manager.stats(),
+            "resume": self.resume_tokens.stats(),
+            "snapshots": self.snapshotter.stats() if self.snapshotter is not None else None,
+            "context": self.context.stats(),
+            "knowledge": self.knowledge.stats(),
+            "packing": self.packer.stats() if self.packer is not None else None,
+            "prompt": {"assembly": self.prompt_assembly, "prefixes": dict(self.prefix_requests)},
+            "response_cache": self.response_cache.stats(),
+            "single_flight": self.single_flight.stats(),
+            "admission": self.admission.stats(),
+            "upstreams": self.upstream_pool.stats(),
+            "circuits": {endpoint: breaker.stats() for endpoint, breaker in self.breakers.items()},
+            "hedging": self.hedging.stats()
+        }
+
+    async def open_session(self, endpoint: str, resume_token: Optional[str] = None) -> Tuple[str, str, Optional[str]]:
+        """
+        Pick the session of a new websocket.
+
+        Args:
+            endpoint: The endpoint the socket is connected to.
+            resume_token: The token given to the client on a previous connection, if any.
+
+        Returns:
+            The session id, its resume token, and the resume outcome (RESUMED, EXPIRED or INVALID),
+            or None when no token was given. Unless resumed, the session is a new one.
+        """
+        outcome = None
+        session_id = None
+        if resume_token:
+            session_id, outcome = self.resume_tokens.verify(resume_token, endpoint)
+            if session_id is not None and not await self.memory_manager.has_session(session_id):
+                # Valid token, but the conversation was evicted meanwhile
+                self.resume_tokens.expired += 1
+                session_id, outcome = None, EXPIRED
+            elif session_id is not None:
+                self.resume_tokens.resumed += 1
+        if session_id is None:
+            session_id = str(uuid.uuid4())
+        return session_id, self.resume_tokens.issue(session_id, endpoint), outcome
+
+    async def build_rag_document(self, query: str) -> str:
+        """
+        The knowledge passages most relevant to a question, for the {rag_document} slot.
+
+        Retrieval runs on a worker thread: embedding the query with a model takes CPU time.
+        """
+        loop = asyncio.get_running_loop()
+        if self.packer is None:
+            results = await loop.run_in_executor(None, self.knowledge.retrieve, query)
+        else:
+            results = self.packer.pack(await loop.run_in_executor(None, self.knowledge.retrieve, query, self.rag_candidates))
+        if results:
+            logger.info(f"Retrieved {len(results)} passages: {', '.join(passage.source for passage, _ in results)}")
+        return format_passages(results)
 
     def is_online(self) -> bool:
         """
-        Check internet connectivity using multiple methods and endpoints
+        Cheap connectivity lookup backed by the background monitor.
+        No network I/O happens here, so it is safe to call on the hot path.
         """
-        # Method 1: Try to connect to Cloudflare DNS
-        def try_socket_connection():
-            hosts = [
-                ("1.1.1.1", 53),  # Cloudflare DNS
-                ("8.8.8.8", 53),  # Google DNS
-                ("api.groq.com", 443)  # Groq API endpoint
-            ]
-            
-            for host, port in hosts:
-                try:
-                    logger.info(f"Checking socket connection to {host}:{port}")
-                    socket.setdefaulttimeout(1.5)
-                    socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
-                    logger.info(f"Socket connection to {host}:{port} succeeded")
-                    return True
-                except socket.error as e:
-                    logger.warning(f"Socket connection to {host}:{port} failed: {str(e)}")
-            
-            return False
-        
-        # Method 2: Try HTTP requests
-        def try_http_request():
-            urls = [
-                "https://www.google.com",
-                "https://www.cloudflare.com",
-                "https://api.groq.com/status"  # May not be a real endpoint, but worth a try
-            ]
-            
-            for url in urls:
-                try:
-                    logger.info(f"Checking HTTP connection to {url}")
-                    response = requests.get(url, timeout=2)
-                    if response.status_code == 200:
-                        logger.info(f"HTTP connection to {url} succeeded")
-                        return True
-                    else:
-                        logger.warning(f"HTTP connection to {url} returned status code {response.status_code}")
-                except requests.exceptions.RequestException as e:
-                    logger.warning(f"HTTP connection to {url} failed: {str(e)}")
-            
-            return False
-        
-        # Try each method
-        if try_socket_connection():
-            return True
-            
-        if try_http_request():
-            return True
-            
-        logger.error("All connectivity checks failed, we appear to be offline")
-        return False
+        return self.connectivity.is_online()
+
+    async def _run_blocking(self, func: Callable[[], T], timeout: float) -> T:
+        """
+        Run a blocking Groq call on the bounded thread pool so the event loop keeps serving other sockets.
+
+        Args:
+            func: The blocking callable to run.
+            timeout: Maximum time to wait for the result, in seconds.
+
+        Returns:
+            The callable's result.
+        """
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(self.blocking_executor, func), timeout=timeout)
+
+    async def _call_with_failover(self, endpoint: str, model: str, call: Callable[[Upstream, str], Awaitable[T]], overflow: bool = False) -> T:
+        """
+        Run a non-streaming Groq call on the least-loaded upstream, failing over on 429/5xx.
+
+        Args:
+            endpoint: The circuit breaker guarding the call ("stt", "tts" or "summary").
+            model: The requested model.
+            call: Performs the call with the given upstream and model.
+            overflow: Whether the fallback chat models may be used.
+
+        Returns:
+            The first successful result.
+
+        Raises:
+            CircuitOpenError: If the endpoint's circuit is open.
+        """
+        breaker = self.breakers[endpoint]
+        started = breaker.before_call()
+        outcome_recorded = False
+        try:
+            last_error: Optional[Exception] = None
+            for upstream, candidate_model in self.upstream_pool.candidates(model, overflow):
+                with self.upstream_pool.track(upstream):
+                    try:
+                        result = await call(upstream, candidate_model)
+                    except Exception as e:
+                        if isinstance(e, APIConnectionError):
+                            self.connectivity.record_failure()
+                        self.upstream_pool.mark_failure(upstream, e)
+                        if not is_retryable(e):
+                            if isinstance(e, asyncio.TimeoutError):
+                                breaker.record_failure()
+                                outcome_recorded = True
+                            raise
+                        last_error = e
+                        self.upstream_pool.failovers += 1
+                        logger.warning(f"Groq call failed on {upstream.name} with {candidate_model}, failing over: {e}")
+                        continue
+                self.upstream_pool.mark_success(upstream)
+                self.connectivity.record_success()
+                breaker.record_success(started)
+                outcome_recorded = True
+                return result
+            if last_error is not None:
+                breaker.record_failure()
+                outcome_recorded = True
+            raise last_error or ValueError("Groq client is not initialized. Make sure GROQ_API_KEY is set.")
+        finally:
+            if not outcome_recorded:
+                breaker.release()
 
-    def groq_speech_to_text(self, audio: bytes) -> str:
-        if not self.groq_client:
+    async def groq_speech_to_text(self, audio: bytes, session_id: Optional[str] = None, on_queue: Optional[QueueCallback] = None) -> str:
+        if not self.groq_async_client and not self.groq_client:
             raise ValueError("Groq client is not initialized. Make sure GROQ_API_KEY is set.")
-            
-        response = self.groq_client.audio.transcriptions.create(
-            file=("audio.wav", audio),  # (nom, bytes, type_mime)
-            model="whisper-large-v3",
-            response_format="json",
-            language="en",
-            temperature=0.0
-        )
-        return response.text
-            
-    def groq_text_to_speech(self, message: str) -> bytes:
-        if not self.groq_client:
+
+        await self.admission.acquire(session_id, 0, on_queue)
+
+        async def transcribe(upstream: Upstream, model: str) -> str:
+            request = dict(
+                file=("audio.wav", audio),  # (nom, bytes, type_mime)
+                model=model,
+                response_format="json",
+                language="en",
+                temperature=0.0,
+                timeout=self.stt_timeout
+            )
+            if hasattr(upstream.async_client, "audio"):
+                response = await asyncio.wait_for(
+                    upstream.async_client.audio.transcriptions.create(**request), timeout=self.stt_timeout)
+            else:
+                response = await self._run_blocking(
+                    lambda: upstream.client.audio.transcriptions.create(**request), timeout=self.stt_timeout)
+            return response.text
+
+        return await self._call_with_failover("stt", "whisper-large-v3", transcribe)
+
+    async def groq_text_to_speech(self, message: str, session_id: Optional[str] = None, on_queue: Optional[QueueCallback] = None) -> bytes:
+        if not self.groq_async_client and not self.groq_client:
             raise ValueError("Groq client is not initialized. Make sure GROQ_API_KEY is set.")
-            
-        response = self.groq_client.audio.speech.create(
-            model="playai-tts",
-            voice="Fritz-PlayAI",
-            input=message,
-            response_format="wav"
-        )
-        return response.read()
 
-    async def groq_voice_chat(self, audio: bytes, prompt: str, session_id: str) -> bytes:
+        await self.admission.acquire(session_id, estimate_tokens(message), on_queue)
+
+        async def synthesize(upstream: Upstream, model: str) -> bytes:
+            request = dict(
+                model=model,
+                voice="Fritz-PlayAI",
+                input=message,
+                response_format="wav",
+                timeout=self.tts_timeout
+            )
+            if hasattr(upstream.async_client, "audio"):
+                async def create_and_read() -> bytes:
+                    response = await upstream.async_client.audio.speech.create(**request)
+                    return await response.read()
+                return await asyncio.wait_for(create_and_read(), timeout=self.tts_timeout)
+            return await self._run_blocking(
+                lambda: upstream.client.audio.speech.create(**request).read(), timeout=self.tts_timeout)
+
+        return await self._call_with_failover("tts", "playai-tts", synthesize)
+
+    async def summarize_history(self, previous_summary: str, transcript: str) -> Optional[str]:
+        """
+        Fold older conversation turns into the rolling summary with a small model.
+
+        Runs in the background, so it never queues for admission: when the budget
+        is exhausted it returns None and the ContextManager uses an extractive summary.
+
+        Args:
+            previous_summary: The current summary, possibly empty.
+            transcript: The messages to fold in.
+
+        Returns:
+            The updated summary, or None if no summary could be produced.
+        """
+        if not self.groq_async_client or not self.is_online():
+            return None
+        content = f"Résumé existant :\n{previous_summary or '(aucun)'}\n\nNouveaux échanges :\n{transcript}"
+        if not self.admission.try_acquire(estimate_tokens(PROMPT_SUMMARY + content) + 256):
+            return None
+
+        async def summarize(upstream: Upstream, model: str) -> str:
+            response = await upstream.async_client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": PROMPT_SUMMARY},
+                    {"role": "user", "content": content}
+                ],
+                model=model,
+                temperature=0.2,
+                max_tokens=256
+            )
+            return response.choices[0].message.content
+
+        return await self._call_with_failover("summary", self.summary_model, summarize, overflow=True)
+
+    async def groq_voice_chat(self, audio: bytes, prompt: str, session_id: str, on_queue: Optional[QueueCallback] = None, deliver: Optional[Callable[[bytes], Awaitable[None]]] = None) -> bytes:
+        """
+        Voice chat answered with a single WAV.
+
+        Args:
+            deliver: Sends the answer audio to the client. The answer is recorded in the
+                session memory once it returns, so an answer interrupted before it was
+                heard is not remembered. Without it, the answer is recorded once synthesized.
+
+        Returns:
+            The answer audio.
+        """
         if not self.is_online():
             raise ValueError("You need to be online for speech chat")
-        voice_to_text: str = self.groq_speech_to_text(audio=audio)
+        voice_to_text: str = await self.groq_speech_to_text(audio=audio, session_id=session_id, on_queue=on_queue)
         
         # Add user message to memory
+        await self.memory_manager.prepare(session_id)
         self.memory_manager.add_user_message(session_id, voice_to_text)
+        # Errors are raised, not spoken: AdmissionTimeout and CircuitOpenError get the endpoint's fallback answer
+        messages = self._build_messages(prompt, voice_to_text, session_id)
         chat_response = ""
-        async for chunk in self.stream_groq_response_with_memory(
-            prompt=prompt, user_query=voice_to_text, session_id=session_id):
-            chat_response += chunk
-        
-        audio_response: bytes = self.groq_text_to_speech(
-            message=chat_response)
+        async with aclosing(self._stream_chat(messages, self.chat_model, session_id, on_queue)) as stream:
+            async for chunk in stream:
+                chat_response += chunk
+
+        audio_response: bytes = await self.groq_text_to_speech(
+            message=chat_response, session_id=session_id, on_queue=on_queue)
+        if deliver is not None:
+            await deliver(audio_response)
 
+        if chat_response:
+            self.memory_manager.add_ai_message(session_id, chat_response)
         return audio_response
 
-    async def stream_text_response(self, prompt: str, user_query: str, model: str = "llama3-70b-8192", session_id: Optional[str] = None) -> AsyncGenerator[str, None]:
-        logger.info(f"stream_text_response called with query: '{user_query}', model: {model}, session_id: {session_id}")
-        
+    async def stream_voice_chat(self, audio: bytes, prompt: str, session_id: str, on_queue: Optional[QueueCallback] = None) -> AsyncGenerator[bytes, None]:
+        """
+        Voice chat where each completed sentence is synthesized while the LLM keeps generating.
+
+        Args:
+            audio: The user's WAV recording.
+            prompt: The system prompt.
+            session_id: The session identifier.
+            on_queue: Called with the queue position while waiting for Groq admission.
+
+        Yields:
+            One WAV segment per sentence, in the order of the answer.
+
+        Raises:
+            AdmissionTimeout, CircuitOpenError: If the request is not admitted or Groq is unavailable.
+        """
+        if not self.is_online():
+            raise ValueError("You need to be online for speech chat")
+        voice_to_text: str = await self.groq_speech_to_text(audio=audio, session_id=session_id, on_queue=on_queue)
+        await self.memory_manager.prepare(session_id)
+        self.memory_manager.add_user_message(session_id, voice_to_text)
+
+        splitter = SentenceSplitter(
+            min_chars=get_env_int("VOICE_SENTENCE_MIN_CHARS", 20),
+            max_chars=get_env_int("VOICE_SENTENCE_MAX_CHARS", 300)
+        )
+        semaphore = asyncio.Semaphore(self.tts_concurrency)
+
+        async def synthesize(sentence: str) -> bytes:
+            async with semaphore:
+                return await self.groq_text_to_speech(message=sentence, session_id=session_id)
+
+        # (sentence, TTS task) in sentence order; only the head of the queue is ever yielded
+        pending: Deque[Tuple[str, asyncio.Task]] = deque()
+        spoken: List[str] = []
+        # Errors are raised, not spoken: AdmissionTimeout and CircuitOpenError get the endpoint's fallback answer
+        messages = self._build_messages(prompt, voice_to_text, session_id)
+        try:
+            async with aclosing(self._stream_chat(messages, self.chat_model, session_id, on_queue)) as stream:
+                iterator = stream.__aiter__()
+                next_chunk: Optional[asyncio.Future] = None
+                try:
+                    while True:
+                        if next_chunk is None:
+                            next_chunk = asyncio.ensure_future(iterator.__anext__())
+                        # A segment is sent as soon as it is synthesized, without waiting for the next tokens
+                        waiting = {next_chunk, pending[0][1]} if pending else {next_chunk}
+                        await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                        while pending and pending[0][1].done():
+                            sentence, task = pending.popleft()
+                            spoken.append(sentence)
+                            yield task.result()
+                        if not next_chunk.done():
+                            continue
+                        done, next_chunk = next_chunk, None
+                        try:
+                            chunk = done.result()
+                        except StopAsyncIteration:
+                            break
+                        for sentence in splitter.feed(chunk):
+                            pending.append((sentence, asyncio.create_task(synthesize(sentence))))
+                finally:
+                    # The stream cannot be closed while a read of it is running
+                    if next_chunk is not None and not next_chunk.done():
+                        next_chunk.cancel()
+                        try:
+                            await next_chunk
+                        except (asyncio.CancelledError, Exception):
+                            pass
+
+            for sentence in splitter.flush():
+                pending.append((sentence, asyncio.create_task(synthesize(sentence))))
+            while pending:
+                sentence, task = pending[0]
+                audio_segment = await task
+                pending.popleft()
+                spoken.append(sentence)
+                yield audio_segment
+        finally:
+            for _, task in pending:
+                task.cancel()
+            # Only what was actually spoken is remembered, even if the answer was interrupted
+            if spoken:
+                self.memory_manager.add_ai_message(session_id, " ".join(spoken))
+
+    async def stream_text_response(self, prompt: str, user_query: str, model: Optional[str] = None, session_id: Optional[str] = None, mode: str = "chat", on_queue: Optional[QueueCallback] = None, rag_document: str = "", record_answer: bool = True, on_fallback: Optional[Callable[[], None]] = None) -> AsyncGenerator[str, None]:
+        """
+        Stream the answer to a question, from the response cache or from Groq.
+
+        Args:
+            record_answer: Whether the complete answer is added to the session memory here.
+                Callers that know what was actually delivered (the websocket endpoints)
+                pass False and record it themselves.
+            on_fallback: Called before a busy, offline or error message is yielded
+                instead of an answer, so the caller does not record it.
+        """
+        model = model or self.chat_model
+        logger.info(f"stream_text_response called with query: '{user_query}', model: {model}, session_id: {session_id}, mode: {mode}")
+
+        def fallback(message: str) -> str:
+            if on_fallback is not None:
+                on_fallback()
+            return message
+
+        # Only first-turn questions are cacheable: once a session has history,
+        # the answer may depend on it and the cache is bypassed.
+        has_history = False
         if session_id:
+            await self.memory_manager.prepare(session_id)
+            has_history = bool(self.memory_manager.get_memory(session_id).messages)
             self.memory_manager.add_user_message(session_id, user_query)
-            
-            # Get chat history and add to prompt if session_id is provided
-            chat_history = ""
-            if session_id in self.memory_manager.memories:
-                chat_history = self.memory_manager.get_chat_history(session_id)
-                
-            # Format the prompt with chat history if it has the {chat_history} placeholder
-            if "{chat_history}" in prompt:
-                prompt = prompt.format(chat_history=f"Historique de la conversation :\n{chat_history}" if chat_history else "", rag_document="")
-            
+
+        cache_key = None
+        if self.response_cache.enabled and not has_history:
+            cache_key = make_cache_key(user_query, mode, PROMPT_VERSION, model, rag_document)
+            cached_chunks = self.response_cache.get(cache_key)
+            if cached_chunks is not None:
+                logger.info(f"Response cache hit for mode {mode}")
+                for chunk in cached_chunks:
+                    yield chunk
+                if session_id and record_answer:
+                    self.memory_manager.add_ai_message(session_id, "".join(cached_chunks))
+                return
+        elif self.response_cache.enabled:
+            self.response_cache.record_bypass()
+
         is_online = self.is_online()
         logger.info(f"Is online: {is_online}, Groq client initialized: {self.groq_async_client is not None}")
-        
-        if is_online and self.groq_async_client:
-            logger.info("Attempting to stream response from Groq API")
-            collected_chunks = []
-            try:
-                async for chunk in self.stream_groq_response_with_memory(prompt, user_query, model, session_id):
+
+        if not self.groq_async_client:
+            logger.error("Cannot stream response: Groq client not initialized")
+            yield fallback(OFFLINE_MESSAGE)
+            return
+        if not is_online:
+            # The monitor may lag behind a recovered network: try the API anyway
+            logger.info("Online check failed but Groq client is available, trying direct API call")
+
+        collected_chunks = []
+        try:
+            messages = self._build_messages(prompt, user_query, session_id, rag_document)
+            async with aclosing(self._stream_chat(messages, model, session_id, on_queue)) as stream:
+                async for chunk in stream:
                     collected_chunks.append(chunk)
                     yield chunk
-                    
-                if session_id:
-                    # Join all chunks to form the complete AI response
-                    complete_response = "".join([chunk for chunk in collected_chunks if chunk])
-                    if complete_response:
-                        self.memory_manager.add_ai_message(session_id, complete_response)
-            except Exception as e:
-                logger.error(f"Error streaming response: {e}")
-                yield f"Error occurred while processing your request: {str(e)}"
+        except AdmissionTimeout as e:
+            logger.warning(f"Request not admitted: {e}")
+            yield fallback(BUSY_MESSAGE)
+            return
+        except CircuitOpenError as e:
+            logger.warning(f"Serving fallback answer: {e}")
+            yield fallback(OFFLINE_MESSAGE)
+            return
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            yield fallback(OFFLINE_MESSAGE if not is_online else f"Error occurred while processing your request: {str(e)}")
+            return
+
+        # Join all chunks to form the complete AI response
+        complete_response = "".join([chunk for chunk in collected_chunks if chunk])
+        if session_id and complete_response and record_answer:
+            self.memory_manager.add_ai_message(session_id, complete_response)
+        if cache_key and complete_response:
+            self.response_cache.put(cache_key, tuple(collected_chunks))
+
+    def _build_messages(self, prompt: str, user_query: str, session_id: Optional[str] = None, rag_document: str = "") -> List[Dict[str, str]]:
+        """
+        Build the chat completion messages, with the conversation history if session_id is provided.
+
+        In "messages" assembly, the system message is the template's static prefix,
+        identical for every request of that template, followed by the rolling summary,
+        the recent turns as user/assistant messages, the resources and the question.
+        In "flat" assembly, the windowed history fills the template's {chat_history}
+        slot (or is appended to the system prompt when there is none).
+        """
+        if self.prompt_assembly == "flat":
+            chat_history = self.context.render_history(session_id, user_query) if session_id else ""
+            if "{chat_history}" in prompt:
+                system_prompt = prompt.format(
+                    chat_history=f"Historique de la conversation :\n{chat_history}" if chat_history else "",
+                    rag_document=rag_document
+                )
+            else:
+                system_prompt = f"{prompt}\n\nConversation history:\n{chat_history}" if chat_history else prompt
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"{user_query}"}
+            ]
+
+        self.prefix_requests[prefix_hash(prompt)] += 1
+        messages = [{"role": "system", "content": static_prefix(prompt)}]
+        if session_id:
+            summary, recent = self.context.window(session_id, user_query)
+            if summary:
+                messages.append({"role": "system", "content": f"{SUMMARY_HEADING}{summary}"})
+            messages.extend(
+                {"role": "assistant" if message.role == "ai" else "user", "content": message.content}
+                for message in recent
+            )
+        if rag_document:
+            messages.append({"role": "system", "content": f"Ressources: {rag_document}"})
+        messages.append({"role": "user", "content": f"{user_query}"})
+        return messages
+
+    async def _stream_chat(self, messages: List[Dict[str, str]], model: str, session_id: Optional[str] = None, on_queue: Optional[QueueCallback] = None) -> AsyncGenerator[str, None]:
+        """Stream a chat completion, sharing one upstream stream between identical concurrent requests."""
+        if not self.single_flight_enabled:
+            stream = self._stream_chat_completion(messages, model, session_id, on_queue)
         else:
-            reason = "Offline mode" if not is_online else "Groq client not initialized"
-            logger.error(f"Cannot stream response: {reason}")
-            # Try direct API call if Groq client is available but online check failed
-            if not is_online and self.groq_async_client:
-                logger.info("Online check failed but Groq client is available, trying direct API call")
+            key = make_flight_key(messages, model)
+            stream = self.single_flight.stream(
+                key, lambda: self._stream_chat_completion(messages, model, session_id, on_queue))
+        # Closing this generator closes the upstream stream before it returns
+        async with aclosing(stream):
+            async for content in stream:
+                yield content
+
+    async def _stream_chat_completion(self, messages: List[Dict[str, str]], model: str, session_id: Optional[str] = None, on_queue: Optional[QueueCallback] = None) -> AsyncGenerator[str, None]:
+        """
+        Stream a chat completion from Groq.
+
+        Unlike stream_groq_response_with_memory, errors are raised to the caller.
+
+        Args:
+            messages: The chat completion messages.
+            model: The LLM model name.
+            session_id: The session making the request, for fair admission.
+            on_queue: Called with the queue position while waiting for admission.
+
+        Yields:
+            The non-empty content deltas.
+        """
+        # Fail fast while the circuit is open, before queueing for admission
+        breaker = self.breakers["chat"]
+        started = breaker.before_call()
+        outcome_recorded = False
+        attempt: Optional[AsyncGenerator[str, None]] = None
+        try:
+            prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+            request_tokens = prompt_tokens + self.expected_completion_tokens
+            await self.admission.acquire(session_id, request_tokens, on_queue)
+
+            # Latency is measured from admission, so queueing does not count as upstream slowness
+            started = time.monotonic()
+            try:
+                attempt, first = await self._first_chat_chunk(messages, model, request_tokens)
+            except StopAsyncIteration:
+                breaker.record_success(started)
+                outcome_recorded = True
+                return
+            except Exception as e:
+                if is_retryable(e):
+                    breaker.record_failure()
+                    outcome_recorded = True
+                raise
+            self.hedging.record(time.monotonic() - started)
+            breaker.record_success(started)
+            outcome_recorded = True
+
+            yield first
+            async for content in attempt:
+                yield content
+        finally:
+            if not outcome_recorded:
+                breaker.release()
+            if attempt is not None:
+                await attempt.aclose()
+
+    async def _chat_attempt(self, messages: List[Dict[str, str]], candidates: List[Tuple[Upstream, str]]) -> AsyncGenerator[str, None]:
+        """
+        One attempt at a streamed chat completion.
+
+        Candidates are tried in order until a stream opens; failover is only
+        possible before the first chunk, after that errors propagate.
+        """
+        last_error: Optional[Exception] = None
+        for upstream, candidate_model in candidates:
+            with self.upstream_pool.track(upstream):
+                logger.info(f"Making API call to Groq with model: {candidate_model} on {upstream.name}")
                 try:
-                    async for chunk in self.stream_groq_response_with_memory(prompt, user_query, model, session_id):
-                        yield chunk
-                    return
+                    prediction_stream = await upstream.async_client.chat.completions.create(
+                        messages=messages,
+                        model=candidate_model,
+                        temperature=0.5,
+                        max_tokens=1024,  # Changed from max_completion_tokens to max_tokens
+                        top_p=1,
+                        stop=None,
+                        stream=True
+                    )
                 except Exception as e:
-                    logger.error(f"Direct API call failed: {e}")
-            
-            yield "Je ne suis pas en mesure de répondre en mode hors ligne pour le moment."
+                    if isinstance(e, APIConnectionError):
+                        self.connectivity.record_failure()
+                    self.upstream_pool.mark_failure(upstream, e)
+                    if not is_retryable(e):
+                        raise
+                    last_error = e
+                    self.upstream_pool.failovers += 1
+                    logger.warning(f"Groq call failed on {upstream.name} with {candidate_model}, failing over: {e}")
+                    continue
+
+                logger.info("API call successful, streaming response")
+                self.connectivity.record_success()
+                self.upstream_pool.mark_success(upstream)
+                try:
+                    async for chunk in prediction_stream:
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            yield content
+                finally:
+                    # Release the HTTP stream promptly when the answer is abandoned
+                    close = getattr(prediction_stream, "close", None)
+                    if close is not None:
+                        await close()
+                return
+        raise last_error or ValueError("Groq client is not initialized. Make sure GROQ_API_KEY is set.")
+
+    async def _first_chat_chunk(self, messages: List[Dict[str, str]], model: str, request_tokens: int) -> Tuple[AsyncGenerator[str, None], str]:
+        """
+        Start a chat completion and wait for its first chunk, hedging if it is slow.
+
+        When hedging is enabled and no chunk arrives within the hedge delay, an
+        identical request is sent to another key or model. The first attempt to
+        produce a chunk wins and the other one is cancelled.
+
+        Returns:
+            The winning attempt and its first chunk.
+
+        Raises:
+            StopAsyncIteration: If the winning attempt produced no content.
+        """
+        candidates = self.upstream_pool.candidates(model)
+        primary = self._chat_attempt(messages, candidates)
+        self.hedging.requests += 1
+        if not self.hedging.enabled or len(candidates) < 2:
+            try:
+                return primary, await primary.__anext__()
+            except BaseException:
+                await primary.aclose()
+                raise
 
-    async def stream_groq_response_with_memory(self, prompt: str, user_query: str, model: str = "llama3-70b-8192", session_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+        attempts = {asyncio.ensure_future(primary.__anext__()): primary}
+        winner: Optional[asyncio.Task] = None
+        try:
+            done, _ = await asyncio.wait(set(attempts), timeout=self.hedging.delay())
+            if not done and self.admission.try_acquire(request_tokens):
+                # Prefer a pair the primary is not using: same model on another key, or the overflow model
+                hedge_candidates = candidates[1:] + candidates[:1]
+                hedge = self._chat_attempt(messages, hedge_candidates)
+                attempts[asyncio.ensure_future(hedge.__anext__())] = hedge
+                self.hedging.fired += 1
+                logger.info(f"No first token after {self.hedging.delay():.2f}s, sending hedged request")
+
+            pending = set(attempts)
+            error: Optional[BaseException] = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    exception = task.exception()
+                    if exception is None or isinstance(exception, StopAsyncIteration):
+                        winner = task
+                        break
+                    error = exception
+            if winner is None:
+                raise error
+
+            if len(attempts) > 1:
+                if attempts[winner] is primary:
+                    self.hedging.primary_wins += 1
+                else:
+                    self.hedging.hedge_wins += 1
+            return attempts[winner], winner.result()
+        finally:
+            for task, attempt in attempts.items():
+                if task is winner:
+                    continue
+                task.cancel()
+                try:
+                    await task
+                except BaseException:
+                    pass
+                await attempt.aclose()
+            if winner is not None and winner.exception() is not None:
+                await attempts[winner].aclose()
+
+    async def stream_groq_response_with_memory(self, prompt: str, user_query: str, model: Optional[str] = None, session_id: Optional[str] = None, on_queue: Optional[QueueCallback] = None, rag_document: str = "") -> AsyncGenerator[str, None]:
         if not self.groq_async_client:
             logger.error("Groq async client is not initialized")
             yield "Groq client is not initialized. Make sure GROQ_API_KEY is set."
             return
             
-        # Prepare messages with memory if session_id is provided
-        messages = [
-            {
-                "role": "system",
-                "content": f"{prompt}"
-            }
-        ]
-        # Add conversation history if session_id is provided
+        model = model or self.chat_model
         if session_id:
-            chat_history = self.memory_manager.get_chat_history(session_id)
-            # Include chat history in the system prompt
-            messages[0]["content"] += f"\n\nConversation history:\n{chat_history}"
-
-        # Add current user query
-        messages.append({
-            "role": "user",
-            "content": f"{user_query}"
-        })
-
+            await self.memory_manager.prepare(session_id)
+        messages = self._build_messages(prompt, user_query, session_id, rag_document)
         try:
-            logger.info(f"Making API call to Groq with model: {model}")
-            prediction_stream = await self.groq_async_client.chat.completions.create(
-                messages=messages,
-                model=model,
-                temperature=0.5,
-                max_tokens=1024,  # Changed from max_completion_tokens to max_tokens
-                top_p=1,
-                stop=None,
-                stream=True
-            )
-            
-            logger.info("API call successful, streaming response")
-            async for chunk in prediction_stream:
-                await asyncio.sleep(0.03)
-                content = chunk.choices[0].delta.content
-                if content:
+            async with aclosing(self._stream_chat(messages, model, session_id, on_queue)) as stream:
+                async for content in stream:
                     yield content
+        except AdmissionTimeout as e:
+            logger.warning(f"Request not admitted: {e}")
+            yield BUSY_MESSAGE
+        except CircuitOpenError as e:
+            logger.warning(f"Serving fallback answer: {e}")
+            yield OFFLINE_MESSAGE
         except Exception as e:
             logging.error(f"Error in Groq API call: {e}")
-            yield f"Error: {str(e)}"
\ No newline at end of file
+            yield f"Error: {str(e)}"
@@ -0,0 +1,98 @@
+"""
+Benchmark of the JSON corpus loader: the former sequential json.load loop
+against the threaded loader, cold and with a warm cache, and the streaming
+mode's peak memory.
+
+Usage:
+    python bench_loader.py [--files 3000] [--kilobytes 8] [--workers 8]
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, List
+
+from app import utils
+from app.utils import get_all_json_content, iter_json_content
+
+
+def write_corpus(directory: str, files: int, kilobytes: int) -> None:
+    """Synthetic knowledge documents of roughly the given size, plus a few broken files."""
+    paragraph = "Le PSG a gagné le classico au Parc des Princes. " * 4
+    for index in range(files):
+        document = {
+            "title": f"Fiche {index}",
+            "joueur": {"nom": f"Joueur {index}", "stats": {"buts": index % 40, "passes": index % 25}},
+            "histoire": [paragraph for _ in range(max(1, kilobytes * 1024 // len(paragraph)))]
+        }
+        with open(os.path.join(directory, f"doc{index:05d}.json"), "w", encoding="utf-8") as document_file:
+            json.dump(document, document_file, ensure_ascii=False)
+    for index in range(3):
+        with open(os.path.join(directory, f"broken{index}.json"), "w", encoding="utf-8") as document_file:
+            document_file.write('{"title": ')
+
+
+def sequential(directory: str) -> List[Any]:
+    """The previous loader: one file after another with json.load (skipping broken files so it completes)."""
+    content = []
+    for name in sorted(os.listdir(directory)):
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as document_file:
+                content.append(json.load(document_file))
+        except ValueError:
+            pass
+    return content
+
+
+def timed(label: str, load: Callable[[], Any], files: int) -> None:
+    started = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed:>8.3f}s {files / elapsed:>10.0f} files/s")
+
+
+def stream_peak(directory: str, workers: int) -> float:
+    """Peak traced memory while consuming the stream without keeping the documents."""
+    tracemalloc.start()
+    for _ in iter_json_content(directory, workers=workers, cache=False, errors=[]):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def list_peak(directory: str, workers: int) -> float:
+    tracemalloc.start()
+    documents = [document for _, document in iter_json_content(directory, workers=workers, cache=False, errors=[])]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del documents
+    return peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=3000, help="Synthetic documents written")
+    parser.add_argument("--kilobytes", type=int, default=8, help="Approximate size of each document")
+    parser.add_argument("--workers", type=int, default=8, help="Loader threads")
+    args = parser.parse_args()
+    utils.JSON_CACHE_SIZE = max(utils.JSON_CACHE_SIZE, args.files)
+    # The broken files are expected
+    logging.getLogger("app.utils").setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_corpus(directory, args.files, args.kilobytes)
+        print(f"{args.files} files of ~{args.kilobytes} KB, parser: {utils.JSON_PARSER}, {args.workers} workers")
+        timed("sequential json.load", lambda: sequential(directory), args.files)
+        timed("threaded, no cache", lambda: list(iter_json_content(directory, workers=args.workers, cache=False, errors=[])), args.files)
+        timed("threaded, cold cache", lambda: get_all_json_content(directory, workers=args.workers), args.files)
+        timed("threaded, warm cache", lambda: get_all_json_content(directory, workers=args.workers), args.files)
+        print(f"peak memory, list:   {list_peak(directory, args.workers) / 2**20:>8.1f} MB")
+        print(f"peak memory, stream: {stream_peak(directory, args.workers) / 2**20:>8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Memory benchmark of chat history: bytes per message before the compact
+Message representation, and after it as a MemoryManager stores it, with one
+slotted object per message and with columnar session storage.
+
+Columnar storage has a fixed cost per session (its column arrays), so it
+only saves memory once sessions hold a few messages: in a run with 200
+character messages, it took about 30% more than slotted objects at one
+message per session, about the same at four, and less beyond. The
+MemoryManager also keeps more per session than the previous dictionary of
+histories, so with very short sessions both variants take more than before.
+
+Usage:
+    python bench_memory.py [--messages 100000] [--sessions 100] [--length 200]
+"""
+import argparse
+import gc
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from app.memory import MemoryManager
+
+
+class LegacyMessage:
+    """The previous Message: per-instance __dict__, datetime timestamp, free-form role string."""
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+        self.timestamp = datetime.now()
+
+
+class LegacyHistory:
+    """The previous ChatHistory: a plain list of messages."""
+
+    def __init__(self):
+        self.messages: List[LegacyMessage] = []
+
+
+def measure(build: Callable[[], Any], messages: int) -> float:
+    """Bytes allocated per message held by the container build() returns."""
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    container = build()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del container
+    return (after - before) / messages
+
+
+def fill_legacy(contents: List[str], sessions: int) -> Dict[str, LegacyHistory]:
+    """The previous per-session storage holding the contents, laid out as fill() does."""
+    memories: Dict[str, LegacyHistory] = {}
+    for index, content in enumerate(contents):
+        session_id = f"session-{index % sessions}"
+        role = "ai" if (index // sessions) % 2 else "user"
+        memories.setdefault(session_id, LegacyHistory()).messages.append(LegacyMessage(role, content))
+    return memories
+
+
+def fill(columnar: bool, contents: List[str], sessions: int) -> MemoryManager:
+    """A MemoryManager holding the contents as alternating questions and answers, spread over sessions."""
+    manager = MemoryManager(
+        session_ttl=0, max_sessions=0, max_total_bytes=0, session_max_messages=0, session_max_bytes=0, columnar=columnar)
+    for index, content in enumerate(contents):
+        session_id = f"session-{index % sessions}"
+        if (index // sessions) % 2:
+            manager.add_ai_message(session_id, content)
+        else:
+            manager.add_user_message(session_id, content)
+    return manager
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000, help="Messages stored per variant")
+    parser.add_argument("--sessions", type=int, default=100, help="Sessions the messages are spread over")
+    parser.add_argument("--length", type=int, default=200, help="Characters per message")
+    args = parser.parse_args()
+
+    # Contents are created up front, so the figures are the per-message overhead on top of the text
+    contents: List[str] = [f"{index:08d} " + "x" * max(0, args.length - 9) for index in range(args.messages)]
+
+    results = {
+        "legacy": measure(lambda: fill_legacy(contents, args.sessions), args.messages),
+        "slotted": measure(lambda: fill(False, contents, args.sessions), args.messages),
+        "columnar": measure(lambda: fill(True, contents, args.sessions), args.messages),
+    }
+    # Each content string is counted at its size plus the str object header
+    text = sum(len(content.encode("utf-8")) + 49 for content in contents) / args.messages
+
+    print(f"{args.messages} messages of {args.length} characters in {args.sessions} sessions (text: ~{text:.0f} bytes/message)")
+    print(f"{'variant':<10} {'overhead':>10} {'total':>10} {'saved':>8}")
+    for name, overhead in results.items():
+        saved = (results["legacy"] - overhead) / (results["legacy"] + text)
+        print(f"{name:<10} {overhead:>9.0f}B {overhead + text:>9.0f}B {saved:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Offline build of the dense vector index of the knowledge documents.
+
+Embeds every passage of KNOWLEDGE_DIR (chunked like the BM25 index) and
+writes the float32 matrix and the passages next to each other; the server
+memory-maps them on startup. Run again after editing the documents.
+
+Passages are embedded with a local CPU model when fastembed or
+sentence-transformers is installed, and by hashing words otherwise.
+
+Usage:
+    python build_vectors.py [--knowledge knowledge] [--output knowledge_vectors]
+        [--embedding auto|fastembed|sentence-transformers|hashing-v1] [--model NAME] [--dimensions 512]
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from app.retrieval import KnowledgeBase
+from app.utils import get_env_int
+from app.vectors import DEFAULT_DIMENSIONS, HASHING_EMBEDDING, HashingEmbedder, VectorIndex, build_vector_index, create_embedder
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--knowledge", default=os.getenv("KNOWLEDGE_DIR", "knowledge"))
+    parser.add_argument("--output", default=os.getenv("RAG_VECTOR_INDEX", "knowledge_vectors"))
+    parser.add_argument("--embedding", default=os.getenv("RAG_EMBEDDING", "auto"))
+    parser.add_argument("--model", default=os.getenv("RAG_EMBEDDING_MODEL", ""), help="Model of fastembed or sentence-transformers")
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS, help="Dimensions of the hashing embedding")
+    args = parser.parse_args()
+
+    knowledge = KnowledgeBase(
+        args.knowledge,
+        chunk_words=get_env_int("RAG_CHUNK_WORDS", 120),
+        chunk_overlap=get_env_int("RAG_CHUNK_OVERLAP", 30)
+    )
+    if args.embedding == HASHING_EMBEDDING:
+        embedder = HashingEmbedder(args.dimensions)
+    else:
+        embedder = create_embedder(args.embedding, args.model)
+    started = time.perf_counter()
+    passages = knowledge.load_passages()
+    build_vector_index(passages, args.output, embedder)
+    elapsed = time.perf_counter() - started
+
+    index = VectorIndex(args.output)
+    print(f"{len(passages)} passages x {index.dimensions} dimensions ({embedder.name} {embedder.model}) "
+          f"written to {args.output}.npy in {elapsed:.2f}s")
+    queries = [passage.text[:80] for passage in passages[:256]]
+    if queries:
+        started = time.perf_counter()
+        index.search_batch(queries, 3)
+        batched = time.perf_counter() - started
+        print(f"Top-3 search: {1000 * batched / len(queries):.3f} ms per query in a batch of {len(queries)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,8 @@ export const useChatWebSocket = ({
   const socketRef = useRef<WebSocket | null>(null)
   const reconnectAttemptsRef = useRef(0)
   const reconnectTimeoutRef = useRef<number | null>(null)
+  // Token sent on reconnect so the server reattaches us to the same conversation
+  const resumeTokenRef = useRef<string | null>(null)
   
   // Connect to WebSocket
   const connect = useCallback(() => {
@@ -43,7 +45,10 @@ export const useChatWebSocket = ({
       setIsConnecting(true)
       setIsError(false)
       
-      const socket = new WebSocket(url)
+      const resumeToken = resumeTokenRef.current
+      const socket = new WebSocket(
+        resumeToken ? `${url}${url.includes('?') ? '&' : '?'}resume=${encodeURIComponent(resumeToken)}` : url
+      )
       
       socket.onopen = () => {
         setIsConnecting(false)
@@ -82,8 +87,10 @@ export const useChatWebSocket = ({
           })
         }
         
-        if (data.session_id && !sessionId) {
+        if (data.session_id) {
+          // A new id means the previous session could not be resumed
           setSessionId(data.session_id)
+          resumeTokenRef.current = data.resume_token ?? null
         }
         
         if (data.done) {
@@ -1,16 +1,22 @@
 import uvicorn
 import json
 import logging
-import uuid
+from contextlib import aclosing
+from typing import Any, List
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from app.weboscket import Model
+from app.admission import AdmissionTimeout
+from app.circuit import CircuitOpenError
+from app.connection import Connection
+from app.resume import RESUMED
+from app.weboscket import BUSY_MESSAGE, OFFLINE_MESSAGE, Model
 from dotenv import load_dotenv
 from app.prompt import (
     PROMPT_TEMPLATE,
     PROMPT_TEMPLATE_COURSE,
     PROMPT_TEMPLATE_EVALUATION
 )
-from app.utils import is_wav_bytes
+from app.streaming import coalesce_tokens
+from app.utils import get_env_bool, is_wav_bytes
 import base64
 
 
@@ -27,51 +33,145 @@ logger = logging.getLogger("")
 # Dictionary to store websocket session IDs
 session_store = {}
 
+# Whether a new user message cancels the answer still streaming (barge-in)
+CANCEL_ON_NEW_MESSAGE = get_env_bool("CANCEL_ON_NEW_MESSAGE", True)
+
+
+@app.on_event("startup")
+async def startup_event():
+    await model_caller.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await model_caller.stop()
+
+
+def queue_notifier(connection: Connection):
+    """Tell the client its queue position while its request waits for Groq admission."""
+    async def notify(position: int) -> None:
+        await connection.send({"queue": position}, control=True, wait=False)
+    return notify
+
+
+async def send_text_stream(connection: Connection, session_id: str, **request: Any) -> None:
+    """
+    Stream the answer to a text question as coalesced text frames, then the done signal.
+
+    The answer is recorded in the session memory here, once, and only the
+    text actually delivered to the client is kept, even if the generation
+    is cancelled. Busy, offline and error messages are not recorded.
+
+    Args:
+        request: The arguments of Model.stream_text_response.
+    """
+    delivered: List[str] = []
+    fallback = False
+
+    def on_fallback() -> None:
+        nonlocal fallback
+        fallback = True
+
+    chunks = model_caller.stream_text_response(
+        session_id=session_id, on_queue=queue_notifier(connection), record_answer=False, on_fallback=on_fallback, **request)
+    try:
+        # Closed here, not by the garbage collector, so a cancelled answer releases its upstream stream at once
+        async with aclosing(coalesce_tokens(chunks, model_caller.flush_policy)) as stream:
+            async for chunk in stream:
+                await connection.send({"text": chunk})
+                delivered.append(chunk)
+    finally:
+        if delivered and not fallback:
+            model_caller.memory_manager.add_ai_message(session_id, "".join(delivered))
+    # Signale la fin de la génération
+    await connection.send({"done": True})
+
+
+async def open_session(websocket: WebSocket, endpoint: str) -> str:
+    """
+    Attach a new websocket to a session and announce it to the client.
+
+    A client reconnecting with `?resume=<resume_token>` gets its previous session
+    back. Otherwise, or if the token is expired or invalid, a new session is
+    created and the frame says why.
+    """
+    session_id, resume_token, outcome = await model_caller.open_session(endpoint, websocket.query_params.get("resume"))
+    session_store[id(websocket)] = session_id
+    frame = {"session_id": session_id, "resume_token": resume_token, "resumed": outcome == RESUMED}
+    if outcome is not None and outcome != RESUMED:
+        frame["resume_error"] = outcome
+        logger.info(f"Resume rejected ({outcome}), new session {session_id}")
+    await websocket.send_json(frame)
+    return session_id
+
+
+@app.get("/stats")
+async def stats():
+    """Runtime statistics (cache, upstream, memory) for monitoring."""
+    return model_caller.get_stats()
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     try:
         await websocket.accept()
-        # Create a unique session ID for this websocket connection
-        session_id = str(uuid.uuid4())
-        session_store[id(websocket)] = session_id
+        # Create a unique session ID for this websocket connection, or resume the previous one
+        session_id = await open_session(websocket, "chat")
         logger.info(f"New websocket connection established with session ID: {session_id}")
 
-        while True:
-            data: str = await websocket.receive_text()
-            user_input: dict = json.loads(data)
-            
-            # CORRECTION: Récupérer l'historique à chaque message
-            chat_history = model_caller.memory_manager.get_chat_history(session_id)
-            logger.info(f"Chat history récupéré: {chat_history}")
-            
+        connection = Connection(websocket, session_id, cancel_on_new_message=CANCEL_ON_NEW_MESSAGE)
+
+        async def answer(user_input: dict) -> None:
+            # The model adds the windowed conversation history to the template
             if "audio" in user_input:
                 audio_b64 = user_input["audio"]
                 audio_bytes = base64.b64decode(audio_b64)
                 if not is_wav_bytes(audio_bytes):
                     logger.error(f"Header reçu : {audio_bytes[:16]}")
                     raise ValueError("Le fichier audio reçu n'est pas au format WAV.")
-                audio_response = await model_caller.groq_voice_chat(
-                    audio_bytes, 
-                    PROMPT_TEMPLATE.format(chat_history=chat_history), 
-                    session_id
-                )
-                audio_b64 = base64.b64encode(audio_response).decode("utf-8")
-                await websocket.send_json({"audio": audio_b64})
-                logger.info("Audio send")
-                await websocket.send_json({"done": True})
+                try:
+                    if user_input.get("stream"):
+                        # Streaming voice mode: one WAV segment per sentence, sent in order
+                        segment = 0
+                        async with aclosing(model_caller.stream_voice_chat(
+                            audio_bytes,
+                            PROMPT_TEMPLATE,
+                            session_id,
+                            on_queue=queue_notifier(connection)
+                        )) as audio_segments:
+                            async for audio_segment in audio_segments:
+                                audio_b64 = base64.b64encode(audio_segment).decode("utf-8")
+                                await connection.send({"audio": audio_b64, "segment": segment})
+                                segment += 1
+                        logger.info(f"Audio streamed in {segment} segments")
+                    else:
+                        async def send_audio(audio_response: bytes) -> None:
+                            audio_b64 = base64.b64encode(audio_response).decode("utf-8")
+                            await connection.send({"audio": audio_b64})
+
+                        # The answer is remembered only once its audio was sent
+                        await model_caller.groq_voice_chat(
+                            audio_bytes, 
+                            PROMPT_TEMPLATE, 
+                            session_id,
+                            on_queue=queue_notifier(connection),
+                            deliver=send_audio
+                        )
+                        logger.info("Audio send")
+                except AdmissionTimeout as e:
+                    logger.warning(f"Voice request not admitted: {e}")
+                    await connection.send({"text": BUSY_MESSAGE})
+                except CircuitOpenError as e:
+                    logger.warning(f"Voice request rejected: {e}")
+                    await connection.send({"text": OFFLINE_MESSAGE})
+                await connection.send({"done": True})
             elif "text" in user_input:
-                # CORRECTION: Formater le prompt avec l'historique actuel
-                prompt_with_history = PROMPT_TEMPLATE.format(
-                    chat_history=chat_history
-                )
-                
-                async for chunk in model_caller.stream_text_response(
-                        prompt_with_history, user_input["text"], session_id=session_id):
-                    await websocket.send_json({"text": chunk})
-                # Signale la fin de la génération
-                await websocket.send_json({"done": True})
+                await send_text_stream(
+                    connection, session_id, prompt=PROMPT_TEMPLATE, user_query=user_input["text"], mode="chat")
             else:
                 raise ValueError("Unproccessable entity")
+
+        await connection.run(answer)
     except WebSocketDisconnect:
         # Clean up the session when the websocket disconnects
         if id(websocket) in session_store:
@@ -85,28 +185,17 @@ async def websocket_endpoint(websocket: WebSocket):
 async def websocket_endpoint_course(websocket: WebSocket):
     try:
         await websocket.accept()
-        session_id = str(uuid.uuid4())
-        session_store[id(websocket)] = session_id
+        session_id = await open_session(websocket, "course")
         logger.info(f"New course websocket connection established with session ID: {session_id}")
         
-        while True:
-            data: str = await websocket.receive_text()
-            user_query: dict = json.loads(data)
-            
-            # CORRECTION: Récupérer l'historique à chaque message
-            chat_history = model_caller.memory_manager.get_chat_history(session_id)
-            logger.info(f"Course - Chat history: {chat_history}")
-            
-            # CORRECTION: Formater le prompt avec l'historique actuel
-            prompt = PROMPT_TEMPLATE_COURSE.format(
-                rag_document="", 
-                chat_history=chat_history
-            )
-            
-            async for chunk in model_caller.stream_text_response(
-                    prompt=prompt, user_query=user_query["text"], session_id=session_id):
-                await websocket.send_json({"text": chunk})
-            await websocket.send_json({"done": True})
+        connection = Connection(websocket, session_id, cancel_on_new_message=CANCEL_ON_NEW_MESSAGE)
+
+        async def answer(user_query: dict) -> None:
+            await send_text_stream(
+                connection, session_id, prompt=PROMPT_TEMPLATE_COURSE, user_query=user_query["text"], mode="course",
+                rag_document=await model_caller.build_rag_document(user_query["text"]))
+
+        await connection.run(answer)
     except WebSocketDisconnect:
         if id(websocket) in session_store:
             del session_store[id(websocket)]
@@ -119,32 +208,18 @@ async def websocket_endpoint_course(websocket: WebSocket):
 async def websocket_endpoint_evaluation(websocket: WebSocket):
     try:
         await websocket.accept()
-        session_id = str(uuid.uuid4())
-        session_store[id(websocket)] = session_id
+        session_id = await open_session(websocket, "evaluation")
         logger.info(f"New evaluation websocket connection established with session ID: {session_id}")
         
-        while True:
-            data: str = await websocket.receive_text()
-            user_query: dict = json.loads(data)
-            
-            # CORRECTION: Récupérer l'historique à chaque message
-            chat_history = model_caller.memory_manager.get_chat_history(session_id)
-            logger.info(f"Evaluation - Chat history: {chat_history}")
-            
-            # CORRECTION: Formater le prompt avec l'historique actuel
-            prompt = PROMPT_TEMPLATE_EVALUATION.format(
-                rag_document="", 
-                chat_history=chat_history
-            )
-            
-            # CORRECTION: Le problème était ici - pas de parsing JSON des chunks
-            async for chunk in model_caller.stream_text_response(
-                    prompt=prompt, user_query=user_query["text"], session_id=session_id):
-                # CORRECTION: Envoyer directement le chunk comme les autres endpoints
-                await websocket.send_json({"text": chunk})
-            
-            # CORRECTION: Ajouter le signal de fin comme les autres endpoints
-            await websocket.send_json({"done": True})
+        connection = Connection(websocket, session_id, cancel_on_new_message=CANCEL_ON_NEW_MESSAGE)
+
+        async def answer(user_query: dict) -> None:
+            # CORRECTION: Envoyer directement le chunk comme les autres endpoints, puis le signal de fin
+            await send_text_stream(
+                connection, session_id, prompt=PROMPT_TEMPLATE_EVALUATION, user_query=user_query["text"], mode="evaluation",
+                rag_document=await model_caller.build_rag_document(user_query["text"]))
+
+        await connection.run(answer)
             
     except WebSocketDisconnect:
         if id(websocket) in session_store:
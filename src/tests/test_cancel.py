@@ -0,0 +1,95 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from app.connection import Connection
+from app.singleflight import StreamCoalescer
+from app.streaming import FlushPolicy, coalesce_tokens
+
+
+class StalledWebSocket:
+    """A websocket whose writes never complete, as with a slow client."""
+
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+
+    async def send_json(self, payload):
+        self.sent.append(payload)
+        await self.release.wait()
+
+
+class Upstream:
+    """An endless token stream that records when it is closed."""
+
+    def __init__(self):
+        self.closed = False
+
+    async def stream(self):
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                yield "token "
+        finally:
+            # Closing an HTTP stream takes a round trip
+            await asyncio.sleep(0.01)
+            self.closed = True
+
+
+def test_upstream_closed_when_cancel_answers_returns():
+    async def scenario():
+        websocket = StalledWebSocket()
+        connection = Connection(websocket, "session")
+        writer = asyncio.create_task(connection._write())
+        single_flight = StreamCoalescer()
+        upstream = Upstream()
+
+        async def answer(user_input):
+            # The loop of main.send_text_stream
+            chunks = single_flight.stream("key", upstream.stream)
+            async with aclosing(coalesce_tokens(chunks, FlushPolicy(interval=0.005))) as stream:
+                async for chunk in stream:
+                    await connection.send({"text": chunk})
+
+        connection._answers.append(asyncio.create_task(connection._run_answer(answer, {})))
+        while not websocket.sent:
+            await asyncio.sleep(0.001)
+
+        assert await connection.cancel_answers()
+        assert upstream.closed
+        assert single_flight.stats()["in_flight"] == 0
+        writer.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_send_text_stream_closes_upstream_when_cancelled(monkeypatch):
+    # main needs the server dependencies (groq, uvicorn, dotenv)
+    main = pytest.importorskip("main", exc_type=ImportError)
+
+    async def scenario():
+        websocket = StalledWebSocket()
+        connection = Connection(websocket, "session")
+        writer = asyncio.create_task(connection._write())
+        upstream = Upstream()
+
+        async def stream_text_response(**request):
+            async with aclosing(upstream.stream()) as stream:
+                async for chunk in stream:
+                    yield chunk
+
+        monkeypatch.setattr(main.model_caller, "stream_text_response", stream_text_response)
+
+        async def answer(user_input):
+            await main.send_text_stream(connection, "session", prompt="", user_query="question", mode="chat")
+
+        connection._answers.append(asyncio.create_task(connection._run_answer(answer, {})))
+        while not websocket.sent:
+            await asyncio.sleep(0.001)
+
+        assert await connection.cancel_answers()
+        assert upstream.closed
+        writer.cancel()
+
+    asyncio.run(scenario())
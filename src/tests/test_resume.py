@@ -0,0 +1,33 @@
+from app.resume import EXPIRED, INVALID, RESUMED, ResumeTokens
+
+
+def test_valid_token_resumes():
+    tokens = ResumeTokens(secret="secret")
+    token = tokens.issue("session", "/ws")
+    assert tokens.verify(token, "/ws") == ("session", RESUMED)
+
+
+def test_token_for_another_endpoint_is_invalid():
+    tokens = ResumeTokens(secret="secret")
+    token = tokens.issue("session", "/ws")
+    assert tokens.verify(token, "/ws/course") == (None, INVALID)
+
+
+def test_non_ascii_signature_is_invalid():
+    tokens = ResumeTokens(secret="secret")
+    payload, _ = tokens.issue("session", "/ws").split(".", 1)
+    assert tokens.verify(f"{payload}.é", "/ws") == (None, INVALID)
+    assert tokens.invalid == 1
+
+
+def test_malformed_signature_is_invalid():
+    tokens = ResumeTokens(secret="secret")
+    payload, signature = tokens.issue("session", "/ws").split(".", 1)
+    for token in (payload, f"{payload}.", f"{payload}.{signature[:-1]}", f"{payload}.{signature}\x00", "...", ""):
+        assert tokens.verify(token, "/ws") == (None, INVALID)
+
+
+def test_old_token_is_expired():
+    tokens = ResumeTokens(secret="secret", max_age=-1)
+    token = tokens.issue("session", "/ws")
+    assert tokens.verify(token, "/ws") == (None, EXPIRED)
@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+import threading
+
+from app.memory import MemoryManager
+from app.store import SQLiteStore
+
+
+def make_manager(store):
+    return MemoryManager(session_ttl=0, store=store, revalidate_after=0.0)
+
+
+def test_failed_flush_is_retried(tmp_path):
+    store = SQLiteStore(str(tmp_path / "sessions.db"))
+    manager = make_manager(store)
+    manager.add_user_message("session", "question")
+    manager.add_ai_message("session", "answer")
+
+    write = store._write
+
+    def locked(batch, now):
+        store._write = write
+        raise sqlite3.OperationalError("database is locked")
+
+    store._write = locked
+    store.flush()
+    assert store.write_errors == 1
+    assert store.stats()["buffered"] == 2
+    # Still buffered: revalidation does not reload the session without its messages
+    assert store.version("session") is None
+    assert [message.content for message in manager.get_memory("session").messages] == ["question", "answer"]
+
+    manager.add_user_message("session", "follow-up")
+    store.flush()
+    assert store.stats()["buffered"] == 0
+    assert store.version("session") == 3
+    store.close()
+
+    reopened = make_manager(SQLiteStore(str(tmp_path / "sessions.db")))
+    contents = [message.content for message in reopened.get_memory("session").messages]
+    assert contents == ["question", "answer", "follow-up"]
+    reopened.close()
+
+
+def test_concurrent_appends_keep_both_messages(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = make_manager(SQLiteStore(path)), make_manager(SQLiteStore(path))
+    first.add_user_message("session", "from the first worker")
+    second.add_user_message("session", "from the second worker")
+    first.store.flush()
+    second.store.flush()
+    assert second.store.stats()["conflicts"] == 1
+
+    reopened = make_manager(SQLiteStore(path))
+    contents = [message.content for message in reopened.get_memory("session").messages]
+    assert sorted(contents) == ["from the first worker", "from the second worker"]
+    for manager in (first, second, reopened):
+        manager.close()
+
+
+def test_prepare_reads_the_store_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = make_manager(SQLiteStore(path)), make_manager(SQLiteStore(path))
+    first.add_user_message("session", "question")
+    first.store.flush()
+
+    reads = []
+    for name in ("load", "version"):
+        method = getattr(second.store, name)
+
+        def recorded(session_id, method=method, name=name):
+            reads.append((name, threading.current_thread() is threading.main_thread()))
+            return method(session_id)
+
+        setattr(second.store, name, recorded)
+
+    async def scenario():
+        await second.prepare("session")
+        assert [message.content for message in second.get_memory("session").messages] == ["question"]
+        # Another worker answers: the cached copy is stale and is reloaded
+        first.add_ai_message("session", "answer")
+        first.store.flush()
+        await second.prepare("session")
+        assert [message.content for message in second.get_memory("session").messages] == ["question", "answer"]
+        assert await second.has_session("session")
+        assert not await second.has_session("unknown")
+
+    asyncio.run(scenario())
+    assert reads and not any(on_loop for _, on_loop in reads)
+    assert second.stale_sessions == 1
+    for manager in (first, second):
+        manager.close()